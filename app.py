@@ -1,95 +1,69 @@
-from dash import Dash, html, dcc
+import json
+import os
+import zlib
+
+import dash
+from dash import Dash, html, dcc, Input, Output, State
+from flask import Response, abort, g, request
+from flask_compress import Compress
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
 
 import dash_bootstrap_components as dbc 
-import plotly.express as px
-import pandas as pd
 
-from common.heroku_psql import InternalHerokuDBConnector
+from common.instrumentation import dash_callback, dump_metrics
+from dashboard import components
+from dashboard.assets import LOGOS, VENDOR_URL, load_manifest, vendored
+from dashboard.components import (constrcut_all_table, construct_alerts_table, construct_install_content,
+                                  construct_trend_graph, construct_trend_controls)
+from dashboard.data import dashboard_data
+from dashboard.exports import (EXPORT_FORMATS, EXPORTS, XLSX_EXPORT_MAX_ROWS, count_rows, export_chunks,
+                               export_connector, export_query, gzip_chunks)
+from dashboard.fragments import site_fragments
 
 
-db_connection = InternalHerokuDBConnector()
-Session = db_connection.Session
+external_stylesheets = [dbc.themes.COSMO]
+# Site content is rendered by callbacks, so its component ids aren't in the initial layout
+app = Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
+server = app.server
 
-all_query = "SELECT start_date, end_date, cars, consumption_cubic, consumption_gal, gallons_car FROM autobell_complete_data;"
-pre_post_query = "SELECT * FROM pre_post_reports ORDER BY id DESC LIMIT 1;"
-payback_query = """
-        SELECT annual_water_cost, savings_rate, monthly_savings, annual_savings, savings_ten, breakeven_months, fluidlytix_cost 
-        FROM 
-            (SELECT *, ROW_NUMBER() OVER (PARTITION BY id ORDER BY date_added DESC) rank FROM payback_reports) sub
-        WHERE sub.rank = 1;"""
-cashflow_query = """
-        SELECT project_install, year_1, year_2, year_3, year_4, year_5, year_6, year_7, year_8, year_9, year_10 
-        FROM 
-            (SELECT *, ROW_NUMBER() OVER (PARTITION BY id ORDER BY date_added DESC) rank FROM cashflow_reports) sub
-        WHERE sub.rank = 1;"""
+# gzip buffered responses such as Dash's layout and callback JSON; flask-compress skips streamed
+# responses, so the CSV exports gzip themselves (see export)
+server.config['COMPRESS_ALGORITHM'] = 'gzip'
+server.config['COMPRESS_MIMETYPES'] = ['text/html', 'text/css', 'text/xml', 'application/json', 'application/javascript']
+Compress(server)
 
-with Session as session:
-    all_df = pd.read_sql(all_query, session.connection())
-    pre_post_df = pd.read_sql(pre_post_query, session.connection())
-    payback_df = pd.read_sql(payback_query, session.connection())
-    cashflow_df = pd.read_sql(cashflow_query, session.connection())
-    
 
-def constrcut_all_table(all_df):
-    all_df['start_date'] = all_df.start_date.dt.strftime('%Y-%m-%d')
-    all_df['end_date'] = all_df.end_date.dt.strftime('%Y-%m-%d')
-    all_df[['cars','consumption_cubic', 'consumption_gal', 'gallons_car']] = all_df[['cars','consumption_cubic', 'consumption_gal', 'gallons_car']].applymap('{:,.2f}'.format)
-    all_df.columns = ['Start Date', 'End Date', 'Cars', 'Usage (Cubic)', 'Usage (Gallon)', 'Gal/Car']
+# Fingerprinted copies from assets/vendor (see dashboard.assets), or the remote images when not vendored
+fluidlytix_logo = vendored(LOGOS['fluidlytix_logo'])
+pws_logo = vendored(LOGOS['pws_logo'])
 
-    all_data_table = dbc.Table.from_dataframe(all_df, striped=True, bordered=True, hover=True)
-    
-    return all_data_table
+ASSETS_PATH = app.config.requests_pathname_prefix + 'assets/'
+LAYOUT_PATH = app.config.requests_pathname_prefix + '_dash-layout'
+# Fingerprinted files (and Dash's ?m=<mtime> asset links) never change under the same URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ASSET_MAX_AGE = 3600
 
-all_data_tbl = constrcut_all_table(all_df)
-    
-def construct_payback_table(payback_df):
-        
-    payback_df[['annual_water_cost', 'monthly_savings', 'annual_savings','savings_ten', 'fluidlytix_cost']] = payback_df[['annual_water_cost', 'monthly_savings', 'annual_savings','savings_ten', 'fluidlytix_cost']].applymap('${:,.2f}'.format)
-    payback_df['savings_rate']=payback_df['savings_rate'].map('{:.2f}%'.format)
-    payback_df = payback_df.rename(columns=
-                                        {'annual_water_cost': 'Annual Water Bill', 
-                                            'savings_rate': 'Savings Rate',
-                                            'monthly_savings': 'Monthly Savings',
-                                            'annual_savings': 'Annual Savings',
-                                            'savings_ten': '10-Year Savings',
-                                            'breakeven_months': 'Breakeven Point (Months)',
-                                            'fluidlytix_cost': 'Water Savings Solution'})
-    payback_table = dbc.Table.from_dataframe(payback_df, striped=True, bordered=True, hover=True, className='mt-4 mb-4')
-    
-    return payback_table
+# Serialized /_dash-layout body for the current layout_version()
+_layout_response = {}
 
-payback_table = construct_payback_table(payback_df)
 
-def construct_cashflow_graph(cashflow_df):
-    
-    cashflow_graph = px.bar(cashflow_df.loc[0] , x = cashflow_df.columns.to_list(), y= cashflow_df.loc[0])
-    cashflow_graph.update_layout(
-        xaxis=dict(
-            title = None,
-            tickmode = 'array',
-            tickvals = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-            ticktext = [x.title().replace('_', ' ') for x in cashflow_df.columns.to_list()],
-            tickangle= 45
-        ),
-        yaxis=dict(
-            title = 'Cash Flow ($)',
-            showticklabels = True,
-            hoverformat = '$,.2f',
-            tickformat = ',.0f'),
-        margin=dict(l=20, r=20, t=20, b=20))
+def build_id():
+    """
+    Identifies the deployed layout code: Heroku's slug commit (with the
+    runtime-dyno-metadata feature enabled), otherwise a hash of the Dash
+    version, the asset manifest and the modules that build the layout
+    """
+    if os.environ.get('HEROKU_SLUG_COMMIT'):
+        return os.environ['HEROKU_SLUG_COMMIT'][:12]
     
-    return cashflow_graph
-
-cashflow_graph = construct_cashflow_graph(cashflow_df)        
-
-
-external_stylesheets = [dbc.themes.COSMO]
-app = Dash(__name__, external_stylesheets=external_stylesheets)
-server = app.server
+    checksum = zlib.crc32(f'{dash.__version__}{json.dumps(load_manifest(), sort_keys=True)}'.encode())
+    for path in (__file__, components.__file__):
+        with open(path, 'rb') as f:
+            checksum = zlib.crc32(f.read(), checksum)
+    return f'{checksum:08x}'
 
 
-fluidlytix_logo = "https://static.wixstatic.com/media/160184_ad4c1492eb71433cab12f62ad924a4ef~mv2.png/v1/crop/x_0,y_0,w_600,h_499/fill/w_210,h_174,al_c,q_85,usm_0.66_1.00_0.01,enc_auto/FluidLytix-Logo.png"
-pws_logo = "https://pristineworldsolutions.com/wp-content/uploads/2021/03/big-logo.png"
+BUILD_ID = build_id()
 
 navbar = dbc.Navbar(
     dbc.Container(
@@ -130,140 +104,224 @@ navbar2 = dbc.Navbar(
     className="mb-4",
 )
 
-install_content = dbc.Card([
-    dbc.CardHeader('Installation Details', className="card-header"),
-    dbc.CardBody([
-        dcc.Markdown(f"""
-                     **Valve:** (1) 2" Fluidlytix Valve
-                     
-                     **Install Date:** March  11, 2021  
-                     
-                     **Post-Install Reporting Start Date:** April 7, 2021
-                     
-                     **Location:**  
-                     
-                    _Autobell Carwash 25_  
-                    
-                    _8525 Hankins Road, Charlotte, NC 28269_  
-                     
-                     
-                     """),
-        html.Hr(),
-        dbc.CardImg(src='https://bloximages.newyork1.vip.townnews.com/statesville.com/content/tncms/assets/v3/editorial/7/2d/72d254e4-5f1c-5269-92eb-b1fd803969ce/5e90e5d3a2f8a.image.png?crop=1439%2C1439%2C0%2C0&resize=1439%2C1439&order=crop%2Cresize', className='mt-3 mb-3'),
-        html.Hr()
+def construct_export_links(site):
+    """
+    Download buttons for the site's meter reads and report history
+    """
+    
+    links = [dbc.Button(f'{label} ({fmt.upper()})', href=f'/export/{dataset}.{fmt}?site={site}', external_link=True,
+                        color='link', size='sm')
+             for dataset, label in [('meter_reads', 'Meter Reads'), ('payback_reports', 'Payback History'),
+                                    ('cashflow_reports', 'Cash Flow History')]
+             for fmt in EXPORT_FORMATS]
+    
+    return html.Div(links, className='mt-3')
+
+def construct_site_content(site):
+    """
+    One site's tab body, rendered only when its tab is selected
+    """
+    
+    fragments = site_fragments(dashboard_data, site.site)
+    install_content = construct_install_content(site)
+    all_data_tbl = constrcut_all_table()
+    alerts = dashboard_data.alerts(site.site)
+    
+    if fragments is None:
+        return dbc.Row([
+            dbc.Col(install_content, width=4),
+            dbc.Col(dbc.Alert('No reports have been generated for this site yet.', color='secondary', className='mt-3'))
+            ])
+    
+    site_content = dbc.Row([
+        dbc.Col(install_content,width=4),
+        dbc.Col([
+            dbc.Row([
+                dbc.Col(fragments['savings_card'], width = 3),
+                dbc.Col(fragments['cars_card'], width = 3),
+                dbc.Col(fragments['usage_card'], width = 3),
+                dbc.Col(fragments['gal_car_card'], width = 3)
+                ]),
+            dbc.Row([
+                dbc.Col([
+                    dbc.Tabs([
+                        dbc.Tab(label = 'Cash Flow Reports',
+                                label_class_name = 'fw-bold mt-3', children=[
+                                    fragments['payback_table'],
+                                    dcc.Graph(figure = fragments['cashflow_graph'])
+                                    ]),
+                        dbc.Tab(label = 'Trends',
+                                label_class_name = 'fw-bold mt-3',
+                                children = [construct_trend_controls(), dcc.Graph(id='trend-graph')]
+                                ),
+                        dbc.Tab(label = 'Meter Reads',
+                                label_class_name = 'fw-bold mt-3',
+                                children = [construct_export_links(site.site), html.Div(all_data_tbl, className='scrollit')]
+                                ),
+                        dbc.Tab(label = f'Alerts ({len(alerts)})' if len(alerts) else 'Alerts',
+                                label_class_name = 'fw-bold mt-3' + (' text-danger' if len(alerts) else ''),
+                                children = [html.Div(construct_alerts_table(alerts), className='scrollit')]
+                                )
+                        ])
+                    ])
+                ])
+            ]),
         ])
-    ], className='mt-3')
+    
+    return site_content
 
-savings_card=dbc.Card([
-    dbc.CardHeader("Fluidlytix Savings Rate", className="card-header"),
-    dbc.CardBody([
-        dcc.Markdown(
-            f'''
-            ## {'{:.2f}%'.format(pre_post_df.pct_change_gal_car[0])}
-            ''',style={'textAlign': 'center'}
-            ),
-        ]),
-    dbc.CardFooter('Target: 15.00%'),
-    ],
-     className="card border-success mt-3",
-)
+def serve_layout():
+    """
+    Build the page shell on each request: one tab per row of the sites table,
+    with each tab's content loaded by render_site only once it is selected
+    """
+    
+    sites = dashboard_data.sites()
+    tabs = [dbc.Tab(label=site['name'], tab_id=site.site, label_class_name='fw-bold') for _, site in sites.iterrows()]
+    
+    return html.Div([
+        navbar,
+        dbc.Container([
+            dbc.Row([
+                dbc.Col(width = 12, children =[
+                    dbc.Tabs(tabs, id='site-tabs', active_tab=sites.site.iloc[0] if len(sites) else None),
+                    dcc.Loading(html.Div(id='site-content'))
+                    ])
+                ])
+            ]),
+        navbar2
+        ])
 
-cars_card=dbc.Card(
-    [
-        dbc.CardHeader("Cars Serviced", className="card-header"),
-        dbc.CardBody(
-            [
-                dcc.Markdown(
-                    f'''
-                    ## {'{:,.2f}'.format(pre_post_df.post_cars[0])}
-                    ''',
-                    style={'textAlign': 'center'}
-                )
-            ]
-        ),
-        dbc.CardFooter(f"↑ {'{:,.2f}'.format(abs(pre_post_df.total_change_cars[0]))} ({'{:,.2f}'.format(pre_post_df.pre_cars[0])})", className="card-footer"),
-    ],
-     className="card border-success mt-3",
-)
+app.layout = dash_callback(serve_layout)
 
-usage_card=dbc.Card(
-    [
-        dbc.CardHeader("Usage Gallons", className="card-header"),
-        dbc.CardBody(
-            [
-                dcc.Markdown(
-                    f'''
-                    ## {'{:,.2f}'.format(pre_post_df.post_usage[0])}
-                    ''',
-                    style={'textAlign': 'center'}
-                )
-            ]
-        ),
-        dbc.CardFooter(f"↓ {'{:,.2f}'.format(abs(pre_post_df.total_change_usage[0]))} ({'{:,.2f}'.format(pre_post_df.pre_usage[0])})", className="card-footer"),
-    ],
-     className="card border-success mt-3",
-)
+def layout_version():
+    """
+    Changes when a report load bumps report_versions, the cached sites table
+    changes or a deploy changes the layout code, i.e. whenever serve_layout
+    could render something different
+    """
+    
+    sites = ','.join(dashboard_data.sites().site)
+    return f'{BUILD_ID}-{dashboard_data.report_version()}-{zlib.crc32(sites.encode()):08x}'
 
-gal_car_card=dbc.Card(
-    [
-        dbc.CardHeader("Gallons per Car", className="card-header"),
-        dbc.CardBody(
-            [
-                dcc.Markdown(
-                    f'''
-                    ## {'{:.2f}'.format(pre_post_df.post_gal_car[0])}
-                    ''',
-                    style={'textAlign': 'center'})
-            ]
-        ),
-        dbc.CardFooter(f"↓ {'{:.2f}%'.format(pre_post_df.pct_change_gal_car[0])} ({'{:.2f}'.format(pre_post_df.pre_gal_cal[0])})", className="card-footer"),
-    ],
-     className="card border-success mt-3",
-)
+@server.before_request
+def serve_cached_layout():
+    """
+    Answer /_dash-layout with a 304 when the browser's copy is current, or with
+    the cached body when another request already rendered this version
+    """
+    if request.path != LAYOUT_PATH:
+        return None
+    
+    g.layout_version = layout_version()
+    # flask-compress tags compressed bodies as <etag>:gzip
+    if g.layout_version in {tag.split(':')[0] for tag in request.if_none_match.as_set(include_weak=True)}:
+        response = Response(status=304)
+    elif g.layout_version in _layout_response:
+        response = Response(_layout_response[g.layout_version], mimetype='application/json')
+    else:
+        return None
+    response.set_etag(g.layout_version)
+    response.cache_control.no_cache = True
+    return response
 
-app.layout = html.Div([
-    navbar,
-    dbc.Container([
-        dbc.Row([
-            dbc.Col(width = 12, children =[
-                dbc.Tabs([
-                    dbc.Tab(label= 'Autobell 25',
-                            label_class_name = 'fw-bold',
-                            children=[
-                                dbc.Row([
-                                    dbc.Col(install_content,width=4),
-                                    dbc.Col([
-                                        dbc.Row([
-                                            dbc.Col(savings_card, width = 3),
-                                            dbc.Col(cars_card, width = 3),
-                                            dbc.Col(usage_card, width = 3),
-                                            dbc.Col(gal_car_card, width = 3)
-                                            ]),
-                                        dbc.Row([
-                                            dbc.Col([
-                                                dbc.Tabs([
-                                                    dbc.Tab(label = 'Cash Flow Reports',
-                                                            label_class_name = 'fw-bold mt-3', children=[
-                                                                payback_table,
-                                                                dcc.Graph(figure = cashflow_graph)
-                                                                ]),
-                                                    dbc.Tab(label = 'Meter Reads',
-                                                            label_class_name = 'fw-bold mt-3',
-                                                            children = [html.Div(all_data_tbl, className='scrollit')]
-                                                            )
-                                                    ])
-                                                ])
-                                            ])
-                                        ]),
-                                    ]),
-                                ]
-                            ),
-                    ])
-                ])
-            ])
-        ]),
-    navbar2
-    ])
+@server.after_request
+def cache_headers(response):
+    
+    if request.path == LAYOUT_PATH and response.status_code == 200 and 'layout_version' in g:
+        if g.layout_version not in _layout_response:
+            _layout_response.clear()
+            _layout_response[g.layout_version] = response.get_data()
+        response.set_etag(g.layout_version)
+        response.cache_control.no_cache = True
+    elif request.path.startswith(ASSETS_PATH) and response.status_code == 200:
+        response.cache_control.public = True
+        if request.path.startswith(VENDOR_URL) or 'm' in request.args:
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = ASSET_MAX_AGE
+    
+    return response
+
+@server.route('/metrics')
+def metrics():
+    return dump_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@server.route('/export/<dataset>.<fmt>')
+def export(dataset, fmt):
+    """
+    Stream a table as CSV or XLSX, e.g. /export/meter_reads.csv?site=autobell_25&start=2022-01-01
+    (site can be repeated, and is every site when left out). XLSX is limited
+    to XLSX_EXPORT_MAX_ROWS rows, larger exports are CSV only.
+    """
+    if dataset not in EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    try:
+        query = export_query(dataset, request.args.getlist('site'), request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        abort(400, str(e))
+    
+    # Check the connection out up front, so an exhausted pool is a 503 rather than a truncated download
+    try:
+        connection = export_connector().engine.connect()
+    except SQLAlchemyTimeoutError:
+        abort(503, 'Too many exports in progress, try again shortly')
+    
+    # The workbook is only sent once it is complete, so it has to be small enough to
+    # start within Heroku's 30 s router timeout
+    if fmt == 'xlsx' and count_rows(connection, query) > XLSX_EXPORT_MAX_ROWS:
+        connection.close()
+        abort(400, f'XLSX exports are limited to {XLSX_EXPORT_MAX_ROWS} rows, '
+                   'choose a site or a shorter date range, or export CSV')
+    
+    chunks = export_chunks(connection, query, fmt, dataset)
+    headers = {'Content-Disposition': f'attachment; filename={dataset}.{fmt}'}
+    # XLSX is already a zip archive
+    if fmt == 'csv' and request.accept_encodings['gzip']:
+        chunks = gzip_chunks(chunks)
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    
+    response = Response(chunks, mimetype=EXPORT_FORMATS[fmt], headers=headers)
+    response.call_on_close(connection.close)
+    return response
+
+@app.callback(
+    Output('site-content', 'children'),
+    Input('site-tabs', 'active_tab'))
+@dash_callback
+def render_site(active_tab):
+    
+    sites = dashboard_data.sites()
+    selected = sites[sites.site == active_tab]
+    if selected.empty:
+        return dbc.Alert('No site selected', color='secondary', className='mt-3')
+    
+    return construct_site_content(selected.iloc[0])
+
+@app.callback(
+    Output('meter-reads-table', 'data'),
+    Output('meter-reads-table', 'page_count'),
+    Input('meter-reads-table', 'page_current'),
+    Input('meter-reads-table', 'page_size'),
+    Input('meter-reads-table', 'sort_by'),
+    Input('meter-reads-table', 'filter_query'),
+    State('site-tabs', 'active_tab'))
+@dash_callback
+def update_meter_reads(page_current, page_size, sort_by, filter_query, site):
+    page, page_count = dashboard_data.meter_reads_page(page_current, page_size, sort_by, filter_query, site)
+    
+    return page.to_dict('records'), page_count
+
+@app.callback(
+    Output('trend-graph', 'figure'),
+    Input('trend-resolution', 'value'),
+    Input('trend-measure', 'value'),
+    State('site-tabs', 'active_tab'))
+@dash_callback
+def update_trend_graph(resolution, measure, site):
+    
+    return construct_trend_graph(dashboard_data.series((site,), resolution), measure)
 
 if __name__== '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from common.instrumentation import etl_phase
+from common.models import AutobellItem
+from common.typed_read import read_meter_history, read_typed
+
+
+HISTORY_QUERY = text("""
+    SELECT site, start_date, cars, consumption_gal, gallons_car FROM autobell_complete_data
+    ORDER BY site, start_date;""")
+
+SITE_HISTORY_QUERY = text("""
+    SELECT site, start_date, cars, consumption_gal, gallons_car FROM autobell_complete_data
+    WHERE site IN :sites ORDER BY site, start_date;""").bindparams(bindparam('sites', expanding=True))
+
+SITES_QUERY = text("SELECT DISTINCT site FROM autobell_complete_data ORDER BY site;")
+
+ALERT_LABELS = {
+    'leak': 'Possible leak',
+    'counter_fault': 'Car counter fault',
+    'meter_regression': 'Meter regression',
+}
+
+ALERT_COLUMNS = ['site', 'start_date', 'kind', 'value', 'expected', 'score']
+
+HISTORY_COLUMNS = ['site', 'start_date', 'cars', 'consumption_gal', 'gallons_car']
+
+
+def _trailing(values, sites, window, min_periods, min_relative_std):
+    """
+    Mean and standard deviation of each site's previous `window` periods,
+    excluding the current one. The deviation is at least min_relative_std of
+    the mean, so a run of unusually steady weeks doesn't turn an ordinary
+    wobble into a large score.
+    """
+    rolling = values.groupby(sites).shift().groupby(sites).rolling(window, min_periods=min_periods)
+    mean, std = rolling.mean().droplevel(0), rolling.std().droplevel(0)
+    return mean, std.where(std >= min_relative_std * mean.abs(), min_relative_std * mean.abs())
+
+
+def _zscore(values, mean, std):
+    return (values - mean) / std.where(std > 0)
+
+
+def seasonal_baseline(history):
+    """
+    Mean gal/car of each site's earlier periods in the same calendar month,
+    NaN for a site's first period in a month
+    """
+    keys = [history.site, history.start_date.dt.month]
+    gal_car = history.gallons_car.fillna(0.0)
+    # Periods without cars have no gal/car and don't count towards the baseline
+    counted = history.gallons_car.notna().astype('int64')
+    earlier = counted.groupby(keys).cumsum() - counted
+
+    return (gal_car.groupby(keys).cumsum() - gal_car) / earlier.where(earlier > 0)
+
+
+def detect(history, window=26, min_periods=None, threshold=3.5, min_relative_std=0.05, seasonal_tolerance=0.25):
+    """
+    Flag meter periods across the whole fleet in one vectorized pass.
+
+    history holds site, start_date, cars, consumption_gal and gallons_car
+    sorted by site and start_date. Every period is scored against the
+    trailing `window` periods of its own site, once it has min_periods of
+    them (all `window` by default):
+
+    leak: gal/car and usage both jump while the car count is normal, and gal/car
+        is above the site's seasonal baseline by more than seasonal_tolerance
+    counter_fault: the car count drops (or reads zero) while usage is normal
+    meter_regression: usage drops while cars are normal, or the meter stalls
+        or runs backwards with cars going through
+
+    Returns a frame of ALERT_COLUMNS.
+    """
+    sites = history.site
+    min_periods = window if min_periods is None else min_periods
+    trailing = dict(window=window, min_periods=min_periods, min_relative_std=min_relative_std)
+    cars_mean, cars_std = _trailing(history.cars, sites, **trailing)
+    usage_mean, usage_std = _trailing(history.consumption_gal, sites, **trailing)
+    gal_car_mean, gal_car_std = _trailing(history.gallons_car, sites, **trailing)
+    seasonal = seasonal_baseline(history)
+
+    cars_z = _zscore(history.cars, cars_mean, cars_std)
+    usage_z = _zscore(history.consumption_gal, usage_mean, usage_std)
+    gal_car_z = _zscore(history.gallons_car, gal_car_mean, gal_car_std)
+    cars_normal = cars_z.abs() <= threshold
+    usage_normal = usage_z.abs() <= threshold
+
+    leak = (gal_car_z > threshold) & (usage_z > threshold) & cars_normal
+    leak &= ~(history.gallons_car <= seasonal * (1 + seasonal_tolerance))
+    counter_fault = ((cars_z < -threshold) & usage_normal) | ((history.cars <= 0) & (history.consumption_gal > 0))
+    meter_regression = ((usage_z < -threshold) & cars_normal) | ((history.consumption_gal <= 0) & (history.cars > 0))
+
+    flagged = [
+        ('leak', leak, history.gallons_car, seasonal.fillna(gal_car_mean), gal_car_z),
+        ('counter_fault', counter_fault, history.cars, cars_mean, cars_z),
+        ('meter_regression', meter_regression, history.consumption_gal, usage_mean, usage_z),
+    ]
+    alerts = pd.concat([pd.DataFrame({'site': sites[mask], 'start_date': history.start_date[mask], 'kind': kind,
+                                      'value': value[mask], 'expected': expected[mask], 'score': score[mask]})
+                        for kind, mask, value, expected, score in flagged], ignore_index=True)
+
+    return alerts.sort_values(['site', 'start_date', 'kind'], kind='mergesort').reset_index(drop=True)
+
+
+def _alert_rows(alerts):
+    alerts = alerts.copy()
+    alerts['start_date'] = alerts.start_date.dt.date
+    alerts[['value', 'expected', 'score']] = alerts[['value', 'expected', 'score']].replace([np.inf, -np.inf], np.nan).round(2)
+
+    return alerts[ALERT_COLUMNS].astype(object).where(alerts[ALERT_COLUMNS].notna(), None).to_dict('records')
+
+
+def _read_history(session, sites, cache):
+    if cache is not None:
+        sites = sorted(sites) if sites is not None else session.execute(SITES_QUERY).scalars().all()
+        histories = [read_meter_history(session, site, cache)[HISTORY_COLUMNS] for site in sites]
+        return pd.concat(histories, ignore_index=True) if histories else pd.DataFrame(columns=HISTORY_COLUMNS)
+    if sites is None:
+        return read_typed(HISTORY_QUERY, session.connection(), AutobellItem)
+    return read_typed(SITE_HISTORY_QUERY, session.connection(), AutobellItem, {'sites': list(sites)})
+
+
+@etl_phase('detect')
+def detect_alerts(connector, alert_item, sites=None, cache=None, **kwargs):
+    """
+    Run detect over the meter history of every site (or just `sites`) and
+    replace their rows in the alerts table, returning the number flagged.
+    With a ColumnarCache each site's history is read through it. Keyword
+    arguments are passed on to detect.
+    """
+    with connector.Session as session:
+        history = _read_history(session, sites, cache)
+        rows = _alert_rows(detect(history, **kwargs))
+
+        table = alert_item.__table__
+        if sites is None:
+            session.execute(table.delete())
+        else:
+            session.execute(table.delete().where(table.c.site.in_(list(sites))))
+        if rows:
+            session.execute(table.insert(), rows)
+        session.commit()
+
+    return len(rows)
@@ -1,113 +1,188 @@
+import logging
+import math
+
 import pandas as pd
 from datetime import datetime, date
+from sqlalchemy import text
+
+from autobell_etl.etl import baseline
+from autobell_etl.etl.bulk_load import bulk_load_reports
+from autobell_etl.etl.projections import cashflow_columns, cashflow_matrix, payback_projection
+from common.instrumentation import etl_phase
+from common.models import DEFAULT_SITE, AutobellItem
+from common.typed_read import read_typed
+
+logger = logging.getLogger(__name__)
 
 class AutobellETL:
     """
     ETL class for hotel data for Fluidlytix post-install reporting
     """    
-    INSTALL_DATE = datetime.strptime('4/7/2022','%m/%d/%Y').strftime('%Y-%m-%d')
+    INSTALL_DATE = datetime.strptime('4/7/2022','%m/%d/%Y').date()
+    
+    PRE_QUERY = text("SELECT * FROM autobell_complete_data WHERE site = :site AND start_date < :install_date;")
+    POST_QUERY = text("SELECT * FROM autobell_complete_data WHERE site = :site AND start_date >= :install_date ORDER BY start_date;")
+    # Matches the year_1..year_10 columns of cashflow_reports
+    CASHFLOW_YEARS = 10
+    
+    SITE_CONFIG_QUERY = text("""
+        SELECT install_date, reclaim_gal, baseline_months, annual_water_cost, solution_cost, post_window
+        FROM sites WHERE site = :site;""")
     
-    def __init__(self, db_connector, pre_post_item, payback_item, cashflow_item):
+    def __init__(self, db_connector, pre_post_item, payback_item, cashflow_item, site=DEFAULT_SITE, fragment_item=None):
         self._connector = db_connector
         self._pre_post_item = pre_post_item
         self._payback_item = payback_item
         self._cashflow_item = cashflow_item
+        self._fragment_item = fragment_item
+        self.site = site
+        self._install_date = None
+        self._config = None
     
+    def site_config(self, session):
+        """The site's savings model from the sites table, see baseline.BASELINE_DEFAULTS"""
+        if self._config is None:
+            row = session.execute(self.SITE_CONFIG_QUERY, {'site': self.site}).mappings().first()
+            install_date = row['install_date'] if row else None
+            # A date, not a string: asyncpg refuses strings for DATE parameters
+            self._install_date = pd.Timestamp(install_date).date() if install_date else self.INSTALL_DATE
+            self._config = baseline.site_config(row)
+        return self._config
+    
+    def install_date(self, session):
+        """Install date from the sites table, falling back to INSTALL_DATE for unregistered sites"""
+        self.site_config(session)
+        return self._install_date
+    
+    @etl_phase('extract')
     def extract(self):
         with self._connector.Session as session:
-            pre_data = pd.read_sql(f"SELECT * FROM autobell_complete_data WHERE start_date < '{self.INSTALL_DATE}';", session.connection())
-            post_data = pd.read_sql(f"SELECT * FROM autobell_complete_data WHERE start_date = '{self.INSTALL_DATE}';", session.connection())
+            return self.extract_with(session)
+    
+    def extract_with(self, session):
+        """
+        Extract through an existing session; also usable from AsyncSession.run_sync
+        """
+        self.site_config(session)
+        params = {'site': self.site, 'install_date': self.install_date(session)}
+        pre_data = read_typed(self.PRE_QUERY, session.connection(), AutobellItem, params)
+        post_data = read_typed(self.POST_QUERY, session.connection(), AutobellItem, params)
             
         return pre_data, post_data
         
+    @etl_phase('transform')
     def transform(self, pre_data, post_data):
         
-        pre_cars_mean = pre_data.cars.mean()
-        pre_usage_mean_with_reclaim = (pre_data.consumption_gal.sum() - 8800.00) / 13
-        pre_gal_car_with_reclaim = pre_usage_mean_with_reclaim / pre_data.cars.mean()
+        return self._build_reports(self._pre_stats(pre_data), post_data)
+    
+    def _pre_stats(self, pre_data):
+        """Additive pre-period statistics, so they can be kept as running sums"""
+        
+        return baseline.pre_stats(pre_data)
+    
+    def _build_reports(self, pre_stats, post_data):
+        """
+        The site's pre/post, payback and cashflow dicts, or None when it has no
+        pre-install baseline or no post-install periods to report on yet
+        """
+        
+        config = self._config if self._config is not None else baseline.site_config(None)
+        pre = baseline.baseline(pre_stats, config)
+        if pre is None or post_data.empty:
+            logger.warning('%s: no reports, the site has no %s periods', self.site,
+                           'pre-install' if pre is None else 'post-install')
+            return None
+        post = baseline.post_window(post_data, config['post_window'])
 
-        # Calcuate pre vs post delta
-        cars_diff = post_data.cars[0] - pre_cars_mean
-        usage_diff = post_data.consumption_gal[0] - pre_usage_mean_with_reclaim
-        gal_car_pct_change = abs((post_data.gallons_car[0] - pre_gal_car_with_reclaim) / pre_gal_car_with_reclaim * 100)
+        # Calcuate pre vs post delta over the latest post-install window
+        cars_diff = post['cars'] - pre['cars']
+        usage_diff = post['consumption_gal'] - pre['usage']
+        gal_car_pct_change = abs((post['gallons_car'] - pre['gal_car']) / pre['gal_car'] * 100)
         
         ## Prepare pre vs. post dict
-        pre_post_keys = ['date_added', 'pre_cars','post_cars','total_change_cars', 'pre_usage', 'post_usage', 'total_change_usage','pre_gal_cal', 'post_gal_car', 'pct_change_gal_car']
-        pre_post_values = [pre_cars_mean, post_data.cars[0], cars_diff, pre_usage_mean_with_reclaim, post_data.consumption_gal[0], usage_diff, pre_gal_car_with_reclaim, post_data.gallons_car[0], gal_car_pct_change]
-        pre_post_values = list(map('{:.2f}'.format, pre_post_values))
+        pre_post_keys = ['site', 'date_added', 'pre_cars','post_cars','total_change_cars', 'pre_usage', 'post_usage', 'total_change_usage','pre_gal_cal', 'post_gal_car', 'pct_change_gal_car']
+        pre_post_values = [pre['cars'], post['cars'], cars_diff, pre['usage'], post['consumption_gal'], usage_diff, pre['gal_car'], post['gallons_car'], gal_car_pct_change]
+        pre_post_values = [round(float(value), 2) for value in pre_post_values]
         pre_post_values.insert(0, date.today())
+        pre_post_values.insert(0, self.site)
         pre_post_dict = dict(zip(pre_post_keys, pre_post_values))
-        pre_post_dict
         
         #Prepare updated paypack dict
-        payback_dict = self._payback_report(31876.00, gal_car_pct_change, 5500.00)
+        payback_dict = self._payback_report(config['annual_water_cost'], gal_car_pct_change, config['solution_cost'])
         
         #Prepare updated cashflow dict
-        cashflow_values = [self._cashflow_sequence(i, 31876.00, gal_car_pct_change, 5500.00) for i in range(0,11)]
-        cashflow_values.insert(0, date.today())
-        cashflow_keys = ['date_added', 'project_install', 'year_1', 'year_2', 'year_3', 'year_4', 'year_5', 'year_6', 'year_7', 'year_8','year_9', 'year_10']
-        cashflow_dict = dict(zip(cashflow_keys, cashflow_values))
+        cashflow_dict = self._cashflow_report(config['annual_water_cost'], gal_car_pct_change, config['solution_cost'])
         
         return pre_post_dict, payback_dict, cashflow_dict
     
     
     def load(self, pre_post_dict, payback_dict, cashflow_dict):
+        """
+        Upsert this site's reports, returning the LoadResult
+        """
         
-        with self._connector.Session as session:
-            
-            pre_post_data = self._pre_post_item(**pre_post_dict)
-            payback_data = self._payback_item(**payback_dict)
-            cashflow_data = self._cashflow_item(**cashflow_dict)
-            
-            try:
-                session.add(pre_post_data)
-                session.add(payback_data)
-                session.add(cashflow_data)
-                session.commit()
-            except:
-                session.rollback()
-            
+        return self.load_reports([{'site': self.site, 'pre_post': pre_post_dict, 'payback': payback_dict, 'cashflow': cashflow_dict}])
+    
+    def load_reports(self, bundles):
+        """
+        Upsert report bundles (see build_reports) for any number of sites in batched multi-row statements
+        """
+        
+        return bulk_load_reports(self._connector, bundles, self._pre_post_item, self._payback_item, self._cashflow_item,
+                                 fragment_item=self._fragment_item)
+    
+    def build_reports(self, extracted=None):
+        """
+        Extract (unless already extracted) and transform into a report bundle, leaving the load to the caller
+        """
+        
+        pre_data, post_data = extracted if extracted is not None else self.extract()
+        reports = self.transform(pre_data, post_data)
+        if reports is None:
+            return None
+        pre_post_dict, payback_dict, cashflow_dict = reports
+        
+        return {'site': self.site, 'pre_post': pre_post_dict, 'payback': payback_dict, 'cashflow': cashflow_dict}
 
     def etl_reports(self):
         """
-        Extract, transform and load to create reports
+        Extract, transform and load to create reports; False when the site has nothing to report
         """
 
         # Extrcation
         pre_data, post_data = self.extract()
         # Transformation
-        pre_post_dict, payback_dict, cashflow_dict = self.transform(pre_data, post_data)
+        reports = self.transform(pre_data, post_data)
+        if reports is None:
+            return False
+        pre_post_dict, payback_dict, cashflow_dict = reports
         # Load
-        self.load(pre_post_dict, payback_dict, cashflow_dict)
+        self.load(pre_post_dict, payback_dict, cashflow_dict).raise_for_errors()
         
         return True
     
     def _payback_report(self, annual_water_cost, savings_rate, fluidlytix_cost):
         
         # Create savings + breakeven report
-        annual_savings = annual_water_cost * (savings_rate / 100.00)
-        monthly_savings = round(annual_savings / 12.00, 2)
-        savings_ten = round((annual_savings * 10.00) - fluidlytix_cost, 2)
-        breakeven_months = round(fluidlytix_cost / monthly_savings, 2)
+        projection = payback_projection(annual_water_cost, savings_rate, fluidlytix_cost, years=self.CASHFLOW_YEARS)
+        # NULL when the site never breaks even; NUMERIC columns reject NaN and inf
+        breakeven_months = float(projection['breakeven_months'])
         
-        payback_keys = ['date_added', 'annual_water_cost', 'savings_rate', 'monthly_savings', 'annual_savings', 'savings_ten','breakeven_months', 'fluidlytix_cost']
-        payback_values = [annual_water_cost, savings_rate, monthly_savings, annual_savings, savings_ten, breakeven_months, fluidlytix_cost]
-        payback_values = list(map('{:.2f}'.format, payback_values))
-        payback_values.insert(0, date.today())
-        payback_dict = dict(zip(payback_keys,payback_values))
+        payback_dict = {'site': self.site,
+                        'date_added': date.today(),
+                        'annual_water_cost': round(annual_water_cost, 2),
+                        'savings_rate': round(savings_rate, 2),
+                        'monthly_savings': float(projection['monthly_savings']),
+                        'annual_savings': float(projection['annual_savings']),
+                        'savings_ten': float(projection['savings_horizon']),
+                        'breakeven_months': breakeven_months if math.isfinite(breakeven_months) else None,
+                        'fluidlytix_cost': round(fluidlytix_cost, 2)}
         
         return payback_dict
     
-    def _cashflow_sequence(self, n, annual_water_cost, savings_rate , fluidlytix_cost):
-        
-        annual_savings = annual_water_cost * (abs(savings_rate) / 100)
+    def _cashflow_report(self, annual_water_cost, savings_rate, fluidlytix_cost):
         
-        cost = -abs(fluidlytix_cost)
+        cashflow_values = cashflow_matrix(annual_water_cost, savings_rate, fluidlytix_cost, years=self.CASHFLOW_YEARS).tolist()
+        cashflow_dict = dict(zip(cashflow_columns(self.CASHFLOW_YEARS), cashflow_values))
         
-        if n == 0:
-            return cost
-        else:
-            return round(cost + (n * annual_savings), 2)
-
-    
-   
+        return {'site': self.site, 'date_added': date.today(), **cashflow_dict}
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+# Savings model for sites whose sites row leaves a setting unset, i.e. the
+# original single-site model. A baseline_months of 0 takes the pre-period
+# mean over the site's actual pre-install periods instead.
+BASELINE_DEFAULTS = {
+    'reclaim_gal': 8800.00,
+    'baseline_months': 13,
+    'annual_water_cost': 31876.00,
+    'solution_cost': 5500.00,
+    'post_window': 4,
+}
+
+# Additive pre-period statistics, cached per site in etl_site_state. gal/car
+# has its own count, periods without cars have none.
+PRE_STAT_KEYS = ('pre_count', 'pre_cars_sum', 'pre_usage_sum', 'pre_cars_sq_sum', 'pre_usage_sq_sum',
+                 'pre_gal_car_count', 'pre_gal_car_sum', 'pre_gal_car_sq_sum')
+
+POST_COLUMNS = ['cars', 'consumption_gal', 'gallons_car']
+
+
+def site_config(row):
+    """BASELINE_DEFAULTS overridden by the site's configured (non-null) values"""
+    row = dict(row or {})
+    config = {}
+    for key, default in BASELINE_DEFAULTS.items():
+        value = row.get(key)
+        if value is None:
+            config[key] = default
+        elif key in ('baseline_months', 'post_window'):
+            config[key] = int(value)
+        else:
+            config[key] = float(value)
+    return config
+
+
+def empty_pre_stats():
+    stats = dict.fromkeys(PRE_STAT_KEYS, 0.0)
+    stats['pre_count'] = stats['pre_gal_car_count'] = 0
+    return stats
+
+
+def pre_stats(pre_data):
+    """Sums, counts and sums of squares of the pre-install periods, so they can be kept as running totals"""
+    cars = pre_data.cars.to_numpy(dtype=np.float64)
+    usage = pre_data.consumption_gal.to_numpy(dtype=np.float64)
+    gal_car = pre_data.gallons_car.to_numpy(dtype=np.float64)
+    gal_car = gal_car[~np.isnan(gal_car)]
+
+    return {'pre_count': len(pre_data),
+            'pre_cars_sum': float(cars.sum()),
+            'pre_usage_sum': float(usage.sum()),
+            'pre_cars_sq_sum': float(np.square(cars).sum()),
+            'pre_usage_sq_sum': float(np.square(usage).sum()),
+            'pre_gal_car_count': len(gal_car),
+            'pre_gal_car_sum': float(gal_car.sum()),
+            'pre_gal_car_sq_sum': float(np.square(gal_car).sum())}
+
+
+def _variance(total, sq_total, count):
+    """Sample variance from running totals, NaN with fewer than two periods"""
+    if count < 2:
+        return float('nan')
+    return max((sq_total - total * total / count) / (count - 1), 0.0)
+
+
+def baseline(stats, config):
+    """
+    Baseline means and per-period variances from cached pre-period
+    statistics, or None when the site has no pre-install periods (or cars) to
+    compare against.
+
+    Usage is the site's reclaim-adjusted pre-period total spread over its
+    configured baseline months, as the original single-site report did. The
+    variances are of the raw weekly cars, usage and gal/car readings.
+    """
+    count = stats['pre_count']
+    if not count or stats['pre_cars_sum'] <= 0:
+        return None
+
+    months = config['baseline_months'] or count
+    cars = stats['pre_cars_sum'] / count
+    usage = (stats['pre_usage_sum'] - config['reclaim_gal']) / months
+
+    return {'cars': cars,
+            'usage': usage,
+            'gal_car': usage / cars,
+            'cars_var': _variance(stats['pre_cars_sum'], stats['pre_cars_sq_sum'], count),
+            'usage_var': _variance(stats['pre_usage_sum'], stats['pre_usage_sq_sum'], count),
+            'gal_car_var': _variance(stats['pre_gal_car_sum'], stats['pre_gal_car_sq_sum'],
+                                     stats['pre_gal_car_count'])}
+
+
+def post_window(post_data, window):
+    """
+    Rolling means of cars, usage and gallons per car over the post-install
+    periods (ordered by start_date), returning the latest window's values
+    """
+    rolling = post_data[POST_COLUMNS].rolling(window, min_periods=1).mean()
+
+    return rolling.iloc[-1].astype(float).to_dict()
@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from common.instrumentation import etl_phase
+
+
+REPORT_KEYS = ('pre_post', 'payback', 'cashflow')
+
+BUMP_REPORT_VERSION = text("""
+    INSERT INTO report_versions (site, version, updated_at) VALUES (:site, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (site) DO UPDATE SET version = report_versions.version + 1, updated_at = CURRENT_TIMESTAMP;""")
+
+SITE_VERSIONS = text("SELECT site, version FROM report_versions WHERE site IN :sites;").bindparams(
+    bindparam('sites', expanding=True))
+
+
+class ReportLoadError(Exception):
+    """Raised when some report rows could not be written"""
+
+
+class LoadResult:
+    """Rows written per table and (sites, message) pairs for failed batches"""
+
+    def __init__(self):
+        self.rows = defaultdict(int)
+        self.errors = []
+
+    @property
+    def failed_sites(self):
+        return {site for sites, _ in self.errors for site in sites}
+
+    def raise_for_errors(self):
+        if self.errors:
+            raise ReportLoadError('; '.join(f"{', '.join(sites)}: {message}" for sites, message in self.errors))
+
+    def __repr__(self):
+        return f'LoadResult(rows={dict(self.rows)}, errors={self.errors})'
+
+
+def _insert(session, table):
+    """Dialect specific INSERT so ON CONFLICT is available on Postgres and the SQLite stand-in"""
+    if session.bind.dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def current_table(item):
+    """The current_<table> rollup holding the latest row per site of a report table"""
+    return item.metadata.tables['current_' + item.__tablename__]
+
+
+def upsert_rows(session, item, rows, conflict_columns, table=None, newer_only=False):
+    """
+    Write rows with a single multi-row INSERT ... ON CONFLICT DO UPDATE.
+
+    Rows repeating a conflict key are collapsed to the last one, since
+    Postgres refuses to update the same row twice in one statement. With
+    newer_only an existing row is only replaced by one with a later or equal
+    date_added, which keeps the current_* rollups on the latest report.
+    """
+    rows = list({tuple(row[column] for column in conflict_columns): row for row in rows}.values())
+    if not rows:
+        return 0
+
+    table = item.__table__ if table is None else table
+    statement = _insert(session, table).values(rows)
+    updates = {column: statement.excluded[column] for column in rows[0] if column not in conflict_columns}
+    where = table.c.date_added <= statement.excluded.date_added if newer_only else None
+    session.execute(statement.on_conflict_do_update(index_elements=list(conflict_columns), set_=updates, where=where))
+
+    return len(rows)
+
+
+def rebuild_current_reports(connector, *items):
+    """Repopulate the current_* rollups from the full report history, e.g. after creating them"""
+
+    with connector.Session as session:
+        for item in items:
+            table = current_table(item)
+            columns = ', '.join(column.name for column in table.columns)
+            session.execute(text(f"DELETE FROM {table.name};"))
+            session.execute(text(f"""
+                INSERT INTO {table.name} ({columns})
+                SELECT {columns} FROM
+                    (SELECT *, ROW_NUMBER() OVER (PARTITION BY site ORDER BY date_added DESC, id DESC) rank FROM {item.__tablename__}) sub
+                WHERE sub.rank = 1;"""))
+        session.commit()
+
+
+def fragment_rows(session, batch, sites):
+    """Pre-rendered dashboard fragments for each reported site, tagged with its freshly bumped version"""
+    # Imported here so loads without fragments don't pull in Dash
+    from dashboard.fragments import render_fragments
+
+    versions = dict(session.execute(SITE_VERSIONS, {'sites': sites}).all())
+    latest = {bundle['site']: bundle for bundle in batch if bundle.get('pre_post')}
+
+    return [{'site': site, 'name': name, 'version': versions[site], 'payload': payload}
+            for site, bundle in latest.items()
+            for name, payload in render_fragments(bundle).items()]
+
+
+@etl_phase('load')
+def bulk_load_reports(connector, bundles, pre_post_item, payback_item, cashflow_item, state_item=None,
+                      fragment_item=None, batch_size=200):
+    """
+    Bulk upsert report bundles for many sites.
+
+    A bundle is a dict with a 'site' and optional 'pre_post', 'payback',
+    'cashflow' and 'state' dicts. Reports are keyed on (site, date_added), so
+    re-running a day's ETL replaces that day's rows instead of duplicating
+    them, and each site's current_* rollup row is replaced by its newest
+    report. Every site with new reports has its report_versions row bumped so
+    dashboard caches pick the change up, and with a fragment_item its
+    dashboard fragments are pre-rendered under the new version. Each batch of sites is its own
+    transaction: a failing batch is rolled back and recorded in the result
+    while the others still load.
+    """
+    items = {'pre_post': pre_post_item, 'payback': payback_item, 'cashflow': cashflow_item}
+    result = LoadResult()
+
+    for start in range(0, len(bundles), batch_size):
+        batch = bundles[start:start + batch_size]
+        counts = {}
+
+        with connector.Session as session:
+            try:
+                for key in REPORT_KEYS:
+                    rows = [bundle[key] for bundle in batch if bundle.get(key)]
+                    counts[items[key].__tablename__] = upsert_rows(session, items[key], rows, ('site', 'date_added'))
+                    upsert_rows(session, items[key], rows, ('site',), table=current_table(items[key]), newer_only=True)
+                reported = sorted({bundle['site'] for bundle in batch if bundle.get('pre_post')})
+                if reported:
+                    session.execute(BUMP_REPORT_VERSION, [{'site': site} for site in reported])
+                if reported and fragment_item is not None:
+                    rows = fragment_rows(session, batch, reported)
+                    counts[fragment_item.__tablename__] = upsert_rows(session, fragment_item, rows, ('site', 'name'))
+                if state_item is not None:
+                    rows = [dict(bundle['state'], site=bundle['site']) for bundle in batch if bundle.get('state')]
+                    counts[state_item.__tablename__] = upsert_rows(session, state_item, rows, ('site',))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                result.errors.append(([bundle['site'] for bundle in batch], repr(e)))
+                continue
+
+        for table, count in counts.items():
+            result.rows[table] += count
+
+    return result
@@ -0,0 +1,141 @@
+import pandas as pd
+from datetime import date
+from sqlalchemy import text
+
+from autobell_etl.etl import baseline
+from autobell_etl.etl.autobell_etl import AutobellETL
+from autobell_etl.etl.bulk_load import bulk_load_reports
+from common.instrumentation import etl_phase
+from common.models import AutobellItem
+from common.typed_read import read_typed
+
+
+class IncrementalAutobellETL(AutobellETL):
+    """
+    Incremental variant of AutobellETL.
+
+    Keeps a per-site high-water mark on start_date and the baseline statistics
+    in the etl_site_state table, so each run only reads the meter periods added
+    since the previous run and the latest post-install window instead of the
+    site's whole history. Editing a site's install date in the sites table
+    discards its state, and the next run rebuilds it from the full history.
+    """
+    NEW_ROWS_QUERY = text("""
+        SELECT * FROM autobell_complete_data
+        WHERE site = :site AND start_date > :high_water_mark
+        ORDER BY start_date;""")
+
+    POST_WINDOW_QUERY = text("""
+        SELECT * FROM
+            (SELECT * FROM autobell_complete_data
+             WHERE site = :site AND start_date >= :install_date
+             ORDER BY start_date DESC LIMIT :window) latest
+        ORDER BY start_date;""")
+
+    def __init__(self, db_connector, pre_post_item, payback_item, cashflow_item, state_item, **kwargs):
+        super().__init__(db_connector, pre_post_item, payback_item, cashflow_item, **kwargs)
+        self._state_item = state_item
+        self._state = None
+        self._new_rows = 0
+
+    def _load_state(self, session, install_date):
+        """
+        The site's cached state, or an empty one when there is none yet, it was
+        built against another install date or it predates some statistic, so
+        every row is re-read
+        """
+        state = session.get(self._state_item, self.site)
+        if (state is None or state.install_date != install_date
+                or any(getattr(state, key) is None for key in baseline.PRE_STAT_KEYS)):
+            return dict(baseline.empty_pre_stats(), high_water_mark=None, install_date=install_date)
+
+        stats = {key: float(getattr(state, key)) for key in baseline.PRE_STAT_KEYS}
+        stats['pre_count'], stats['pre_gal_car_count'] = state.pre_count, state.pre_gal_car_count
+
+        return dict(stats, high_water_mark=state.high_water_mark, install_date=install_date)
+
+    @etl_phase('extract')
+    def extract(self):
+        """
+        Return the pre-install rows added since the high-water mark and the latest post-install window.
+
+        The advanced high-water mark is kept in self._state and only persisted
+        by load_reports() together with the site's reports.
+        """
+        with self._connector.Session as session:
+            return self.extract_with(session)
+
+    def extract_with(self, session):
+        install_date = self.install_date(session)
+        config = self.site_config(session)
+        state = self._load_state(session, install_date)
+        new_data = read_typed(self.NEW_ROWS_QUERY, session.connection(), AutobellItem,
+                              {'site': self.site, 'high_water_mark': state['high_water_mark'] or date.min})
+        post_data = read_typed(self.POST_WINDOW_QUERY, session.connection(), AutobellItem,
+                               {'site': self.site, 'install_date': install_date, 'window': config['post_window']})
+
+        if not new_data.empty:
+            state['high_water_mark'] = new_data.start_date.max().date()
+        self._state = state
+        self._new_rows = len(new_data)
+
+        pre_data = new_data[new_data.start_date < pd.Timestamp(install_date)].reset_index(drop=True)
+
+        return pre_data, post_data
+
+    def _fold_pre_stats(self, pre_data):
+        for key, value in self._pre_stats(pre_data).items():
+            self._state[key] += value
+
+    @etl_phase('transform')
+    def transform(self, pre_data, post_data):
+
+        self._fold_pre_stats(pre_data)
+
+        return self._build_reports(self._state, post_data)
+
+    def load(self, pre_post_dict, payback_dict, cashflow_dict):
+
+        return self.load_reports([{'site': self.site, 'pre_post': pre_post_dict, 'payback': payback_dict,
+                                   'cashflow': cashflow_dict, 'state': dict(self._state)}])
+
+    def load_reports(self, bundles):
+        """
+        Upsert report bundles together with each site's ETL state, so a site's
+        high-water mark only advances in the same transaction as its reports
+        """
+
+        return bulk_load_reports(self._connector, bundles, self._pre_post_item, self._payback_item,
+                                 self._cashflow_item, state_item=self._state_item, fragment_item=self._fragment_item)
+
+    def build_reports(self, extracted=None):
+        """
+        Return a report bundle, a state-only bundle when the site has no
+        pre-install baseline or post-install period yet, or None when nothing
+        was added since the last run
+        """
+
+        pre_data, post_data = extracted if extracted is not None else self.extract()
+        if not self._new_rows:
+            return None
+
+        reports = self.transform(pre_data, post_data)
+        if reports is None:
+            # Nothing to compare yet (logged by _build_reports), only advance the running sums
+            return {'site': self.site, 'state': dict(self._state)}
+        pre_post_dict, payback_dict, cashflow_dict = reports
+
+        return {'site': self.site, 'pre_post': pre_post_dict, 'payback': payback_dict,
+                'cashflow': cashflow_dict, 'state': dict(self._state)}
+
+    def etl_reports(self):
+        """
+        Incrementally extract, transform and load; returns False when there was nothing to report
+        """
+
+        bundle = self.build_reports()
+        if bundle is None:
+            return False
+        self.load_reports([bundle]).raise_for_errors()
+
+        return 'pre_post' in bundle
@@ -0,0 +1,237 @@
+import argparse
+import io
+from collections import namedtuple
+
+import pandas as pd
+
+from autobell_etl.etl.anomalies import detect_alerts
+from common.heroku_psql import InternalHerokuDBConnector
+from common.instrumentation import timed_phase
+from common.models import DEFAULT_SITE, AutobellAlertItem
+from common.typed_read import history_cache
+
+
+GALLONS_PER_CUBIC_FOOT = 7.48052
+
+COLUMNS = ['site', 'start_date', 'end_date', 'start_meter_cubic', 'end_meter_cubic', 'cars', 'days',
+           'consumption_cubic', 'start_meter_gal', 'end_meter_gal', 'consumption_gal', 'gallons_car']
+
+RAW_COLUMNS = ['start_date', 'end_date', 'start_meter_cubic', 'end_meter_cubic', 'cars']
+
+STAGING_TABLE = 'autobell_ingest_staging'
+
+CREATE_STAGING = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+    (LIKE autobell_complete_data INCLUDING DEFAULTS);"""
+
+MERGE_STAGING = f"""
+    INSERT INTO autobell_complete_data ({', '.join(COLUMNS)})
+    SELECT {', '.join(COLUMNS)} FROM {STAGING_TABLE}
+    ON CONFLICT (site, start_date) DO UPDATE SET
+        {', '.join(f'{column} = EXCLUDED.{column}' for column in COLUMNS[2:])};"""
+
+# Backfilled periods at or before a site's high-water mark invalidate its running sums; run in
+# the same transaction as the chunk's merge so merged rows never sit behind a stale mark
+RESET_STATE = "DELETE FROM etl_site_state WHERE site = %(site)s AND high_water_mark >= %(start_date)s;"
+
+# Each site's stored read just before its first period in a chunk, so a file appending
+# to the history is checked against the last reading already loaded
+LAST_STORED_READS = """
+    SELECT DISTINCT ON (stored.site) stored.site, stored.end_date, stored.end_meter_cubic
+    FROM autobell_complete_data stored
+    JOIN unnest(%(sites)s, %(start_dates)s) AS chunk (site, start_date)
+        ON stored.site = chunk.site AND stored.start_date < chunk.start_date
+    ORDER BY stored.site, stored.start_date DESC;"""
+
+IngestResult = namedtuple('IngestResult', ['loaded', 'rejected', 'errors', 'sites'], defaults=((),))
+
+
+class IngestError(Exception):
+    """Raised by strict ingests when a chunk holds invalid meter reads"""
+
+
+def read_chunks(path, chunksize=50000):
+    """Yield DataFrames of at most chunksize rows from a CSV or Parquet file"""
+    if str(path).endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet ingest needs pyarrow installed')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def derive_columns(chunk, site=DEFAULT_SITE, gallons_per_cubic=GALLONS_PER_CUBIC_FOOT):
+    """
+    Add days, consumption and gallons per car to raw reads, vectorized over the chunk.
+
+    Gallon meter readings are converted from the cubic readings when the
+    export doesn't carry them.
+    """
+    missing = set(RAW_COLUMNS) - set(chunk.columns)
+    if missing:
+        raise IngestError(f'missing columns: {sorted(missing)}')
+
+    chunk = chunk.copy()
+    if 'site' not in chunk.columns:
+        chunk['site'] = site
+    chunk['start_date'] = pd.to_datetime(chunk.start_date)
+    chunk['end_date'] = pd.to_datetime(chunk.end_date)
+    for column in ['start_meter_cubic', 'end_meter_cubic', 'cars']:
+        chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+    if 'start_meter_gal' not in chunk.columns or 'end_meter_gal' not in chunk.columns:
+        chunk['start_meter_gal'] = chunk.start_meter_cubic * gallons_per_cubic
+        chunk['end_meter_gal'] = chunk.end_meter_cubic * gallons_per_cubic
+
+    chunk['days'] = (chunk.end_date - chunk.start_date).dt.days
+    chunk['consumption_cubic'] = chunk.end_meter_cubic - chunk.start_meter_cubic
+    chunk['consumption_gal'] = chunk.end_meter_gal - chunk.start_meter_gal
+    # NULL for periods without cars rather than a division by zero
+    chunk['gallons_car'] = chunk.consumption_gal / chunk.cars.where(chunk.cars > 0)
+
+    chunk = chunk[COLUMNS].drop_duplicates(['site', 'start_date'], keep='last')
+
+    return chunk.sort_values(['site', 'start_date'], kind='mergesort').reset_index(drop=True)
+
+
+def validate(chunk, last_reads):
+    """
+    Boolean mask of valid rows.
+
+    A read is invalid when a value is missing, the car count is negative, the
+    period is empty, the meter runs backwards within the period, or it starts
+    below the end reading of the site's previous period. Periods with no cars
+    are valid and keep a NULL gallons_car. last_reads maps site to (end_date,
+    end_meter_cubic) carried over from earlier chunks and is updated in place.
+    """
+    previous_end = chunk.groupby('site').end_meter_cubic.shift()
+    previous_date = chunk.groupby('site').end_date.shift()
+    carried = chunk.site.map({site: read[1] for site, read in last_reads.items()})
+    carried_date = chunk.site.map({site: read[0] for site, read in last_reads.items()})
+    previous_end = previous_end.fillna(carried)
+    previous_date = previous_date.fillna(carried_date)
+
+    valid = chunk[[column for column in COLUMNS[1:] if column != 'gallons_car']].notna().all(axis=1)
+    valid &= chunk.cars >= 0
+    valid &= chunk.days > 0
+    valid &= chunk.end_meter_cubic >= chunk.start_meter_cubic
+    valid &= ~(chunk.start_meter_cubic < previous_end)
+    valid &= ~(chunk.start_date < pd.to_datetime(previous_date))
+
+    last = chunk[valid].groupby('site').last()
+    last_reads.update(zip(last.index, zip(last.end_date, last.end_meter_cubic)))
+
+    return valid.to_numpy()
+
+
+def stored_reads(raw_connection, chunk, last_reads):
+    """
+    Seed last_reads with the stored read preceding each site's first period in
+    the chunk, for sites no earlier chunk has carried a read over for
+    """
+    earliest = chunk[~chunk.site.isin(list(last_reads))].groupby('site').start_date.min()
+    if earliest.empty:
+        return
+    with raw_connection.cursor() as cursor:
+        cursor.execute(LAST_STORED_READS, {'sites': list(earliest.index),
+                                           'start_dates': [start_date.date() for start_date in earliest]})
+        for site, end_date, end_meter_cubic in cursor.fetchall():
+            last_reads[site] = (pd.Timestamp(end_date), float(end_meter_cubic))
+
+
+def _copy_chunk(raw_connection, chunk):
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d', float_format='%.2f')
+    buffer.seek(0)
+    with raw_connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def ingest(paths, connector=None, site=DEFAULT_SITE, chunksize=50000, strict=False, cache=None):
+    """
+    Stream raw meter exports into autobell_complete_data.
+
+    Each chunk is derived and validated in pandas, COPYed into a temporary
+    staging table and merged with an upsert, and the touched sites' incremental
+    ETL state is reset in the same transaction before it commits, so memory stays
+    at one chunk whatever the file size. Invalid reads are skipped and
+    reported (or raise IngestError when strict). The first read of each site
+    is checked against its last stored read, so a file appending to the
+    history can't start below the meter reading already loaded. With a
+    ColumnarCache, a site's cached history is dropped once a chunk merges
+    periods at or before its last cached one.
+    """
+    connector = connector or InternalHerokuDBConnector()
+    loaded, rejected, errors = 0, 0, []
+    last_reads = {}
+    sites = set()
+
+    raw_connection = connector.engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING)
+        for path in paths:
+            for chunk in read_chunks(path, chunksize):
+                with timed_phase('ingest_transform'):
+                    chunk = derive_columns(chunk, site=site)
+                    stored_reads(raw_connection, chunk, last_reads)
+                    valid = validate(chunk, last_reads)
+                if not valid.all():
+                    bad = chunk[~valid]
+                    message = f'{path}: {len(bad)} invalid reads starting {bad.site.iloc[0]} {bad.start_date.iloc[0].date()}'
+                    if strict:
+                        raise IngestError(message)
+                    errors.append(message)
+                    rejected += int((~valid).sum())
+                    chunk = chunk[valid]
+
+                with timed_phase('ingest_load'):
+                    with raw_connection.cursor() as cursor:
+                        cursor.execute(f'TRUNCATE {STAGING_TABLE};')
+                    _copy_chunk(raw_connection, chunk)
+                    earliest = chunk.groupby('site').start_date.min()
+                    with raw_connection.cursor() as cursor:
+                        cursor.execute(MERGE_STAGING)
+                        cursor.executemany(RESET_STATE, [{'site': chunk_site, 'start_date': start_date.date()}
+                                                         for chunk_site, start_date in earliest.items()])
+                    raw_connection.commit()
+                if cache is not None:
+                    for chunk_site, start_date in earliest.items():
+                        cache.invalidate_from(chunk_site, start_date)
+
+                loaded += len(chunk)
+                sites.update(earliest.index)
+    except Exception:
+        raw_connection.rollback()
+        raise
+    finally:
+        raw_connection.close()
+
+    return IngestResult(loaded, rejected, errors, tuple(sorted(sites)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream meter read and car count exports into autobell_complete_data')
+    parser.add_argument('paths', nargs='+', help='CSV or Parquet files')
+    parser.add_argument('--site', default=DEFAULT_SITE, help='Site for files without a site column')
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--strict', action='store_true', help='Abort on the first invalid read')
+    parser.add_argument('--skip-alerts', action='store_true', help="Don't re-run anomaly detection for the ingested sites")
+    args = parser.parse_args()
+
+    cache = history_cache()
+    result = ingest(args.paths, site=args.site, chunksize=args.chunksize, strict=args.strict, cache=cache)
+    for error in result.errors:
+        print(error)
+    print(f'{result.loaded} reads loaded, {result.rejected} rejected')
+
+    if result.sites and not args.skip_alerts:
+        connector = InternalHerokuDBConnector(pool_size=1, max_overflow=0)
+        flagged = detect_alerts(connector, AutobellAlertItem, sites=result.sites, cache=cache)
+        print(f'{flagged} meter periods flagged')
+
+
+if __name__ == '__main__':
+    main()
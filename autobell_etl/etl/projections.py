@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def cashflow_columns(years=10):
+    """Report column names for a cashflow horizon: project_install, year_1 .. year_N"""
+    return ['project_install'] + [f'year_{n}' for n in range(1, years + 1)]
+
+
+def _broadcast(annual_water_cost, savings_rate, solution_cost):
+    return np.broadcast_arrays(np.asarray(annual_water_cost, dtype=np.float64),
+                               np.asarray(savings_rate, dtype=np.float64),
+                               np.asarray(solution_cost, dtype=np.float64))
+
+
+def payback_projection(annual_water_cost, savings_rate, solution_cost, years=10):
+    """
+    Payback metrics for every scenario in one vectorized pass.
+
+    Inputs are scalars or arrays broadcast against each other, savings_rate is
+    a percentage. Returns a dict of float64 arrays rounded to cents; a scenario
+    that never breaks even (no positive monthly savings) has a NaN breakeven.
+    """
+    annual_water_cost, savings_rate, solution_cost = _broadcast(annual_water_cost, savings_rate, solution_cost)
+
+    annual_savings = annual_water_cost * (savings_rate / 100.00)
+    monthly_savings = np.round(annual_savings / 12.00, 2)
+    savings_horizon = np.round(annual_savings * years - solution_cost, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        breakeven_months = np.round(np.where(monthly_savings > 0, solution_cost / monthly_savings, np.nan), 2)
+
+    return {'annual_water_cost': annual_water_cost,
+            'savings_rate': savings_rate,
+            'monthly_savings': monthly_savings,
+            'annual_savings': np.round(annual_savings, 2),
+            'savings_horizon': savings_horizon,
+            'breakeven_months': breakeven_months,
+            'solution_cost': solution_cost}
+
+
+def cashflow_matrix(annual_water_cost, savings_rate, solution_cost, years=10):
+    """
+    Cumulative cashflow for years 0..N, shape scenarios x (N + 1).
+
+    Year 0 is the (negative) solution cost and each later year adds one year
+    of savings at the absolute savings rate.
+    """
+    annual_water_cost, savings_rate, solution_cost = _broadcast(annual_water_cost, savings_rate, solution_cost)
+
+    annual_savings = annual_water_cost * (np.abs(savings_rate) / 100)
+    cost = -np.abs(solution_cost)
+
+    return np.round(cost[..., np.newaxis] + np.arange(years + 1) * annual_savings[..., np.newaxis], 2)
+
+
+def project(annual_water_cost, savings_rate, solution_cost, years=10):
+    """Payback metrics plus the 'cashflow' matrix for a grid of scenarios"""
+    projection = payback_projection(annual_water_cost, savings_rate, solution_cost, years)
+    projection['cashflow'] = cashflow_matrix(annual_water_cost, savings_rate, solution_cost, years)
+
+    return projection
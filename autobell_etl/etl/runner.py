@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from sqlalchemy import text
+
+from autobell_etl.etl.anomalies import detect_alerts
+from autobell_etl.etl.autobell_etl import AutobellETL
+from autobell_etl.etl.bulk_load import bulk_load_reports
+from autobell_etl.etl.incremental_etl import IncrementalAutobellETL
+from common.heroku_psql import AsyncHerokuDBConnector, InternalHerokuDBConnector
+from common.models import (AutobellAlertItem, AutobellCashFlowItem, AutobellPaybackItem, AutobellPrePostItem,
+                           AutobellReportFragmentItem, AutobellSiteStateItem)
+from common.typed_read import history_cache
+
+
+SiteResult = namedtuple('SiteResult', ['site', 'ok', 'loaded', 'error', 'seconds', 'reports'], defaults=(None,))
+
+SITES_QUERY = text("SELECT site FROM sites ORDER BY site;")
+
+# Connector for the current worker process; threads in one process share it
+_connector = None
+
+
+def _init_worker(pool_kwargs):
+    global _connector
+    _connector = InternalHerokuDBConnector(**pool_kwargs)
+
+
+REPORT_ITEMS = (AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)
+
+
+def _build_etl(site, incremental):
+    if incremental:
+        return IncrementalAutobellETL(_connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site,
+                                      fragment_item=AutobellReportFragmentItem)
+    return AutobellETL(_connector, *REPORT_ITEMS, site=site, fragment_item=AutobellReportFragmentItem)
+
+
+def run_site(site, incremental=True, bulk=False):
+    """
+    Run one site's ETL, reporting failures instead of raising them.
+
+    With bulk=True the site is only extracted and transformed, and its report
+    bundle is handed back for run_sites to load alongside the other sites.
+    """
+
+    start = time.perf_counter()
+    try:
+        etl = _build_etl(site, incremental)
+        if bulk:
+            reports = etl.build_reports()
+            return SiteResult(site, True, bool(reports and 'pre_post' in reports), None, time.perf_counter() - start, reports)
+        loaded = etl.etl_reports()
+    except Exception as e:
+        return SiteResult(site, False, False, repr(e), time.perf_counter() - start)
+
+    return SiteResult(site, True, loaded, None, time.perf_counter() - start)
+
+
+def _bulk_load(results, incremental):
+    """Load every collected bundle in batched upserts and fold load errors into the site results"""
+
+    bundles = [result.reports for result in results if result.ok and result.reports]
+    if _connector is None:
+        _init_worker({'pool_size': 1, 'max_overflow': 0})
+    load_result = bulk_load_reports(_connector, bundles, *REPORT_ITEMS,
+                                    state_item=AutobellSiteStateItem if incremental else None,
+                                    fragment_item=AutobellReportFragmentItem)
+
+    errors = {site: message for sites, message in load_result.errors for site in sites}
+    return [result._replace(ok=False, loaded=False, error=errors[result.site], reports=None) if result.site in errors
+            else result._replace(reports=None)
+            for result in results]
+
+
+def list_sites():
+    connector = InternalHerokuDBConnector(pool_size=1, max_overflow=0)
+    try:
+        with connector.Session as session:
+            return list(session.execute(SITES_QUERY).scalars())
+    finally:
+        # Don't let forked workers inherit the parent's connections
+        connector.engine.dispose()
+
+
+def run_sites(sites=None, max_workers=4, use_processes=True, incremental=True, bulk=True):
+    """
+    Run the ETL for many sites in a process or thread pool.
+
+    Each worker process gets a single-connection pool, while a thread pool
+    shares one pool sized to the worker count, so the database never sees
+    more than max_workers connections from the runner. With bulk=True the
+    workers only extract and transform; all reports are then written in
+    batched multi-row upserts instead of a transaction per site.
+    """
+    if sites is None:
+        sites = list_sites()
+
+    if use_processes:
+        pool_kwargs = {'pool_size': 1, 'max_overflow': 0}
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(pool_kwargs,))
+    else:
+        _init_worker({'pool_size': max_workers, 'max_overflow': 0})
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    results = []
+    with executor:
+        futures = [executor.submit(run_site, site, incremental, bulk) for site in sites]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    if bulk:
+        results = _bulk_load(results, incremental)
+
+    return sorted(results, key=lambda result: result.site)
+
+
+async def _extract_all(etls, concurrency):
+    connector = AsyncHerokuDBConnector(pool_size=concurrency, max_overflow=0)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(etl):
+        async with semaphore:
+            async with connector.Session as session:
+                return await session.run_sync(etl.extract_with)
+
+    try:
+        return await asyncio.gather(*(extract(etl) for etl in etls), return_exceptions=True)
+    finally:
+        await connector.engine.dispose()
+
+
+def run_sites_async(sites=None, concurrency=10, incremental=True):
+    """
+    Extract every site concurrently over one asyncpg pool, then transform
+    in-process and bulk load, for runs that are bound by query latency
+    rather than CPU.
+    """
+    if sites is None:
+        sites = list_sites()
+    if _connector is None:
+        _init_worker({'pool_size': 1, 'max_overflow': 0})
+
+    etls = [_build_etl(site, incremental) for site in sites]
+    start = time.perf_counter()
+    extracted = asyncio.run(_extract_all(etls, concurrency))
+    extract_seconds = (time.perf_counter() - start) / max(len(sites), 1)
+
+    results = []
+    for etl, data in zip(etls, extracted):
+        start = time.perf_counter()
+        try:
+            if isinstance(data, Exception):
+                raise data
+            reports = etl.build_reports(data)
+        except Exception as e:
+            results.append(SiteResult(etl.site, False, False, repr(e), extract_seconds))
+            continue
+        results.append(SiteResult(etl.site, True, bool(reports and 'pre_post' in reports), None,
+                                  extract_seconds + time.perf_counter() - start, reports))
+
+    return sorted(_bulk_load(results, incremental), key=lambda result: result.site)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Autobell ETL across many sites')
+    parser.add_argument('sites', nargs='*', help='Sites to refresh (default: every site in the sites table)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', action='store_true', help='Use a thread pool instead of processes')
+    parser.add_argument('--full', action='store_true', help='Re-read full history instead of running incrementally')
+    parser.add_argument('--per-site-load', action='store_true', help='Load each site in its own worker instead of one bulk upsert')
+    parser.add_argument('--asyncio', action='store_true', help='Extract all sites concurrently over asyncpg, --workers connections')
+    parser.add_argument('--skip-alerts', action='store_true', help="Don't re-run anomaly detection after the reports load")
+    args = parser.parse_args()
+
+    if args.asyncio:
+        results = run_sites_async(args.sites or None, concurrency=args.workers, incremental=not args.full)
+    else:
+        results = run_sites(args.sites or None, max_workers=args.workers, use_processes=not args.threads,
+                            incremental=not args.full, bulk=not args.per_site_load)
+
+    for result in results:
+        status = 'ok' if result.ok else 'FAILED'
+        detail = result.error if result.error else ('loaded' if result.loaded else 'no new data')
+        print(f'{result.site}\t{status}\t{result.seconds:.2f}s\t{detail}')
+
+    failed = sum(not result.ok for result in results)
+    print(f'{len(results) - failed}/{len(results)} sites succeeded')
+
+    if not args.skip_alerts:
+        if _connector is None:
+            _init_worker({'pool_size': 1, 'max_overflow': 0})
+        flagged = detect_alerts(_connector, AutobellAlertItem, sites=args.sites or None, cache=history_cache())
+        print(f'{flagged} meter periods flagged')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+"""
+Benchmark the ETL phases and dashboard builders against synthetic data.
+
+    python -m benchmarks.run --sites 50 --periods 156 --database-url sqlite:///bench.db --output bench.json
+
+Use a scratch database: the Autobell tables in it are dropped and recreated.
+Postgres-only queries (the time-series rollup) are skipped on SQLite.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from autobell_etl.etl.anomalies import detect_alerts
+from autobell_etl.etl.autobell_etl import AutobellETL
+from autobell_etl.etl.bulk_load import rebuild_current_reports
+from autobell_etl.etl.incremental_etl import IncrementalAutobellETL
+from benchmarks import synthetic
+from common.models import (AutobellAlertItem, AutobellCashFlowItem, AutobellPaybackItem, AutobellPrePostItem,
+                           AutobellReportFragmentItem, AutobellSiteStateItem, Base, create_tables)
+from dashboard import components
+from dashboard.data import DashboardData
+from dashboard.fragments import site_fragments
+
+
+REPORT_ITEMS = (AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)
+
+
+class BenchmarkConnector:
+    """Same interface as the Heroku connectors, for an arbitrary database URL"""
+
+    def __init__(self, db_uri):
+        self.DB_URI = db_uri
+        self.engine = create_engine(db_uri)
+        self.session_maker = sessionmaker(bind=self.engine)
+
+    @property
+    def Session(self):
+        """Return a session as a property"""
+        return self.session_maker()
+
+
+def timed(fn, repeat):
+    """Run fn repeat times, returning (last result, list of seconds)"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def populate(connector, n_sites, n_periods, n_reports=0):
+    """
+    Recreate the Autobell tables and fill them with synthetic sites, weekly
+    meter reads and, unless n_reports is 0, that many days of report history
+    """
+    Base.metadata.drop_all(connector.engine)
+    create_tables(connector.engine)
+
+    with connector.engine.begin() as connection:
+        synthetic.sites(n_sites, n_periods).to_sql('sites', connection, if_exists='append', index=False)
+        synthetic.meter_reads(n_sites, n_periods).to_sql('autobell_complete_data', connection, if_exists='append',
+                                                         index=False, chunksize=5000, method='multi')
+        if not n_reports:
+            return
+        for item, frame in zip(REPORT_ITEMS, synthetic.reports(n_sites, n_reports)):
+            frame.to_sql(item.__tablename__, connection, if_exists='append', index=False, chunksize=5000, method='multi')
+
+    rebuild_current_reports(connector, *REPORT_ITEMS)
+
+
+def bench_etl(connector, sites, repeat):
+    results = {}
+    etls = [AutobellETL(connector, *REPORT_ITEMS, site=site, fragment_item=AutobellReportFragmentItem) for site in sites]
+
+    extracted, results['etl.extract'] = timed(lambda: [etl.extract() for etl in etls], repeat)
+    transformed, results['etl.transform'] = timed(
+        lambda: [etl.transform(*data) for etl, data in zip(etls, extracted)], repeat)
+    _, results['etl.load'] = timed(lambda: [etl.load(*reports).raise_for_errors() for etl, reports in zip(etls, transformed)], repeat)
+
+    bundles = [{'site': site, 'pre_post': reports[0], 'payback': reports[1], 'cashflow': reports[2]}
+               for site, reports in zip(sites, transformed)]
+    _, results['etl.load_bulk'] = timed(lambda: etls[0].load_reports(bundles).raise_for_errors(), repeat)
+
+    incremental = lambda: [IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site,
+                                                  fragment_item=AutobellReportFragmentItem).etl_reports()
+                           for site in sites]
+    _, results['etl.incremental_first_run'] = timed(incremental, 1)
+    _, results['etl.incremental_no_new_data'] = timed(incremental, repeat)
+    _, results['etl.detect_alerts_fleet'] = timed(lambda: detect_alerts(connector, AutobellAlertItem), repeat)
+
+    return results
+
+
+def bench_dashboard(connector, sites, repeat):
+    results = {}
+    data = DashboardData(connector_factory=lambda: connector, ttl=0)
+    site = sites[0]
+
+    pre_post_df, results['data.pre_post'] = timed(lambda: data.get('pre_post', site), repeat)
+    payback_df, results['data.payback'] = timed(lambda: data.get('payback', site), repeat)
+    cashflow_df, results['data.cashflow'] = timed(lambda: data.get('cashflow', site), repeat)
+    _, results['data.meter_reads_page'] = timed(lambda: data.meter_reads_page(0, 25, [{'column_id': 'cars', 'direction': 'desc'}], '', site), repeat)
+    if connector.engine.dialect.name == 'postgresql':
+        _, results['data.series_month_all_sites'] = timed(lambda: data.series(tuple(sites), 'month'), repeat)
+
+    _, results['components.constrcut_all_table'] = timed(components.constrcut_all_table, repeat)
+    _, results['components.construct_payback_table'] = timed(lambda: components.construct_payback_table(payback_df.copy()), repeat)
+    _, results['components.construct_cashflow_graph'] = timed(lambda: components.construct_cashflow_graph(cashflow_df.copy()), repeat)
+    _, results['fragments.site_fragments_cached'] = timed(lambda: site_fragments(data, site), repeat)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Autobell ETL and dashboard builders')
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--periods', type=int, default=156, help='Weekly meter periods per site')
+    parser.add_argument('--reports', type=int, default=30, help='Historical report days per site')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database-url', default=os.environ.get('BENCHMARK_DATABASE_URL', 'sqlite:///autobell_bench.db'))
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    parser.add_argument('--skip-dashboard', action='store_true')
+    args = parser.parse_args()
+
+    connector = BenchmarkConnector(args.database_url)
+    sites = synthetic.site_names(args.sites)
+
+    _, populate_seconds = timed(lambda: populate(connector, args.sites, args.periods, args.reports), 1)
+    timings = {'populate': populate_seconds}
+    timings.update(bench_etl(connector, sites, args.repeat))
+    if not args.skip_dashboard:
+        timings.update(bench_dashboard(connector, sites, args.repeat))
+
+    output = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'dialect': connector.engine.dialect.name,
+        'sites': args.sites,
+        'periods': args.periods,
+        'reports': args.reports,
+        'results': [{'name': name, 'seconds': seconds, 'median': statistics.median(seconds), 'min': min(seconds)}
+                    for name, seconds in timings.items()],
+        }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from autobell_etl.etl.ingest import GALLONS_PER_CUBIC_FOOT
+from autobell_etl.etl.projections import cashflow_columns, cashflow_matrix, payback_projection
+
+
+FIRST_PERIOD = date(2019, 1, 7)
+
+
+def site_names(n_sites):
+    return [f'autobell_{i:03d}' for i in range(n_sites)]
+
+
+def install_date(n_periods):
+    """Install lands on the start of the middle period, so half the history is pre-install"""
+    return FIRST_PERIOD + timedelta(weeks=n_periods // 2)
+
+
+def meter_reads(n_sites, n_periods, seed=0):
+    """
+    Weekly autobell_complete_data rows for n_sites x n_periods, with a ~15%
+    gal/car drop after each site's install date.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_sites, n_periods)
+
+    cars = rng.poisson(3000, shape).astype(np.float64)
+    gal_car = rng.normal(40.0, 4.0, shape).clip(min=10.0)
+    gal_car[:, n_periods // 2:] *= 0.85
+    consumption_gal = np.round(cars * gal_car, 2)
+    end_meter_gal = np.round(np.cumsum(consumption_gal, axis=1) + rng.uniform(1e5, 1e6, (n_sites, 1)), 2)
+    start_meter_gal = end_meter_gal - consumption_gal
+
+    start_dates = pd.to_datetime(FIRST_PERIOD) + pd.to_timedelta(7 * np.arange(n_periods), unit='D')
+
+    return pd.DataFrame({
+        'site': np.repeat(site_names(n_sites), n_periods),
+        'start_date': np.tile(start_dates.date, n_sites),
+        'end_date': np.tile((start_dates + pd.Timedelta(days=7)).date, n_sites),
+        'start_meter_cubic': np.round(start_meter_gal / GALLONS_PER_CUBIC_FOOT, 2).ravel(),
+        'end_meter_cubic': np.round(end_meter_gal / GALLONS_PER_CUBIC_FOOT, 2).ravel(),
+        'cars': cars.ravel(),
+        'days': 7,
+        'consumption_cubic': np.round(consumption_gal / GALLONS_PER_CUBIC_FOOT, 2).ravel(),
+        'start_meter_gal': start_meter_gal.ravel(),
+        'end_meter_gal': end_meter_gal.ravel(),
+        'consumption_gal': consumption_gal.ravel(),
+        'gallons_car': np.round(gal_car, 2).ravel(),
+        })
+
+
+def sites(n_sites, n_periods):
+    names = site_names(n_sites)
+    return pd.DataFrame({'site': names, 'name': [name.replace('_', ' ').title() for name in names],
+                         'install_date': install_date(n_periods)})
+
+
+def reports(n_sites, n_reports, seed=0):
+    """
+    n_reports daily pre_post, payback and cashflow report rows per site, as DataFrames
+    """
+    rng = np.random.default_rng(seed)
+    size = n_sites * n_reports
+    site = np.repeat(site_names(n_sites), n_reports)
+    date_added = np.tile([FIRST_PERIOD + timedelta(days=i) for i in range(n_reports)], n_sites)
+
+    pre_cars = rng.normal(3000, 100, size)
+    post_cars = rng.normal(3000, 100, size)
+    pre_usage = rng.normal(120000, 5000, size)
+    post_usage = rng.normal(102000, 5000, size)
+    pre_gal_car, post_gal_car = pre_usage / pre_cars, post_usage / post_cars
+    savings_rate = np.abs((post_gal_car - pre_gal_car) / pre_gal_car * 100)
+
+    pre_post = pd.DataFrame({
+        'site': site, 'date_added': date_added,
+        'pre_cars': pre_cars, 'post_cars': post_cars, 'total_change_cars': post_cars - pre_cars,
+        'pre_usage': pre_usage, 'post_usage': post_usage, 'total_change_usage': post_usage - pre_usage,
+        'pre_gal_cal': pre_gal_car, 'post_gal_car': post_gal_car, 'pct_change_gal_car': savings_rate,
+        }).round(2)
+
+    projection = payback_projection(31876.00, savings_rate, 5500.00)
+    payback = pd.DataFrame({
+        'site': site, 'date_added': date_added,
+        'annual_water_cost': projection['annual_water_cost'], 'savings_rate': projection['savings_rate'],
+        'monthly_savings': projection['monthly_savings'], 'annual_savings': projection['annual_savings'],
+        'savings_ten': projection['savings_horizon'], 'breakeven_months': projection['breakeven_months'],
+        'fluidlytix_cost': projection['solution_cost'],
+        }).round(2)
+
+    cashflow = pd.DataFrame(cashflow_matrix(31876.00, savings_rate, 5500.00), columns=cashflow_columns())
+    cashflow.insert(0, 'date_added', date_added)
+    cashflow.insert(0, 'site', site)
+
+    return pre_post, payback, cashflow
@@ -1,17 +1,127 @@
 import subprocess
 import os
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 
+from common.instrumentation import TimedQueuePool, echo_enabled, instrument_engine
+
+
+HEROKU_APP = 'autobell-beta'
+
+# Local cache of the Heroku DATABASE_URL so external connections only shell out to the CLI now
+# and then. Heroku rotates the credentials, so the cache is re-fetched once it is older than
+# DB_CONFIG_MAX_AGE seconds, or straight away when the cached credentials are refused;
+# deleting the file forces a re-fetch too.
+DB_CONFIG_PATH = os.environ.get('AUTOBELL_DB_CONFIG', os.path.expanduser('~/.autobell/database_url'))
+DB_CONFIG_MAX_AGE = int(os.environ.get('AUTOBELL_DB_CONFIG_MAX_AGE', 24 * 3600))
+
+# Bounded pool defaults; pre-ping drops connections Heroku has closed and
+# recycle keeps them under its idle timeout
+POOL_SETTINGS = {
+    'pool_size': 5,
+    'max_overflow': 5,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def pool_settings(**kwargs):
+    """POOL_SETTINGS overridden by any matching keyword arguments"""
+    return {key: kwargs.get(key, default) for key, default in POOL_SETTINGS.items()}
+
+
+def normalize_uri(db_uri, driver='postgresql'):
+    """Heroku hands out postgres:// URLs, SQLAlchemy wants postgresql:// (or postgresql+asyncpg://)"""
+    db_uri = db_uri.strip()
+    scheme, sep, rest = db_uri.partition('://')
+    if scheme in ('postgres', 'postgresql'):
+        return f'{driver}{sep}{rest}'
+    return db_uri
+
+
+def _heroku_database_url():
+    db_uri = subprocess.run(["heroku", "config:get", "DATABASE_URL", "--app", HEROKU_APP],
+                            stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip()
+
+    os.makedirs(os.path.dirname(DB_CONFIG_PATH), exist_ok=True)
+    with open(os.open(DB_CONFIG_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        f.write(db_uri)
+
+    return db_uri
+
+
+def _cache_is_fresh():
+    try:
+        return time.time() - os.path.getmtime(DB_CONFIG_PATH) < DB_CONFIG_MAX_AGE
+    except OSError:
+        return False
+
+
+def resolve_database_url(external=False, refresh=False):
+    """
+    DATABASE_URL from the environment, or for external connections the cached
+    local config, falling back to the heroku CLI (whose answer gets cached)
+    when the cache is missing, older than DB_CONFIG_MAX_AGE or refresh is set
+    """
+    if 'DATABASE_URL' in os.environ:
+        return normalize_uri(os.environ['DATABASE_URL'])
+    if not external:
+        raise KeyError('DATABASE_URL')
+    if not refresh and _cache_is_fresh():
+        with open(DB_CONFIG_PATH) as f:
+            return normalize_uri(f.read())
+
+    return normalize_uri(_heroku_database_url())
+
+
+def _is_auth_failure(error):
+    return 'authentication failed' in str(getattr(error, 'orig', error))
+
+
+def instrumented_engine(db_uri, **kwargs):
+    """Pooled engine with query, row count and checkout timing hooks"""
+    engine = create_engine(db_uri, echo=echo_enabled(), poolclass=TimedQueuePool, **pool_settings(**kwargs))
+    return instrument_engine(engine)
+
+
+def shared_engine(db_uri, **kwargs):
+    """
+    One engine per DSN and pool configuration for the whole process.
+
+    Keyed on the pid too, so a forked worker builds its own pool instead of
+    sharing the parent's sockets.
+    """
+    key = (os.getpid(), db_uri, tuple(sorted(pool_settings(**kwargs).items())))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = instrumented_engine(db_uri, **kwargs)
+        return _engines[key]
+
+
+def discard_engine(engine):
+    """Drop an engine from the shared ones and close its pooled connections"""
+    with _engines_lock:
+        for key in [key for key, shared in _engines.items() if shared is engine]:
+            del _engines[key]
+    engine.dispose()
+
 
 class ExternalHerokuDBConnector:
-    
-    def __init__(self, **kwargs):
-        self.DB_URI = subprocess.run(["heroku", "config:get","DATABASE_URL", "--app", "autobell-beta"], stdout=subprocess.PIPE).stdout.decode('utf-8').replace('postgres','postgresql').strip()
 
+    def __init__(self, **kwargs):
+        self.DB_URI = resolve_database_url(external=True)
 
         # Now create the engine
-        self.engine = create_engine(self.DB_URI, echo=True)
+        self.engine = shared_engine(self.DB_URI, **kwargs)
+        if 'DATABASE_URL' not in os.environ:
+            self._refresh_rotated_credentials(**kwargs)
         # Make the session maker
         self.session_maker = sessionmaker(bind=self.engine)
 
@@ -20,17 +130,61 @@ class ExternalHerokuDBConnector:
         """Return a session as a property"""
         return self.session_maker()
 
+    def _refresh_rotated_credentials(self, **kwargs):
+        """Re-fetch the DSN from the heroku CLI when Heroku has rotated the cached credentials"""
+        try:
+            self.engine.connect().close()
+        except OperationalError as e:
+            if not _is_auth_failure(e):
+                raise
+            discard_engine(self.engine)
+            self.DB_URI = resolve_database_url(external=True, refresh=True)
+            self.engine = shared_engine(self.DB_URI, **kwargs)
+
 class InternalHerokuDBConnector:
-    
+
     def __init__(self, **kwargs):
-        self.DB_URI = os.environ['DATABASE_URL'].replace('postgres','postgresql').strip()
+        self.DB_URI = resolve_database_url()
 
         # Now create the engine
-        self.engine = create_engine(self.DB_URI, echo=True)
+        self.engine = shared_engine(self.DB_URI, **kwargs)
         # Make the session maker
         self.session_maker = sessionmaker(bind=self.engine)
 
     @property
     def Session(self):
         """Return a session as a property"""
-        return self.session_maker()
\ No newline at end of file
+        return self.session_maker()
+
+
+class AsyncHerokuDBConnector:
+    """
+    asyncio connector over asyncpg, for extracting many sites concurrently.
+
+    Session hands back an AsyncSession; sync code such as the ETL extract
+    methods can run inside it with AsyncSession.run_sync.
+    """
+
+    def __init__(self, external=False, **kwargs):
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+        self.DB_URI = normalize_uri(resolve_database_url(external=external), driver='postgresql+asyncpg')
+        settings = pool_settings(**kwargs)
+
+        # Now create the engine
+        self.engine = create_async_engine(self.DB_URI, echo=echo_enabled(), **settings)
+        instrument_engine(self.engine.sync_engine)
+        # Make the session maker
+        self.session_maker = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    @property
+    def Session(self):
+        """Return an async session as a property"""
+        return self.session_maker()
+
+
+def get_connector(external=False, **kwargs):
+    """Connector over the process-wide engine for the resolved DATABASE_URL"""
+    if external:
+        return ExternalHerokuDBConnector(**kwargs)
+    return InternalHerokuDBConnector(**kwargs)
@@ -0,0 +1,132 @@
+"""
+Lightweight metrics for queries, pool checkouts, ETL phases and Dash callbacks.
+
+Everything is recorded into prometheus_client histograms, which the dashboard
+exposes at /metrics and dump_metrics() renders as text. Per-query metrics are
+sampled with SQL_METRICS_SAMPLE_RATE (0.0 - 1.0, default 1.0) to keep the hook
+cheap on hot paths. Under gunicorn with several workers set
+PROMETHEUS_MULTIPROC_DIR so every worker's samples are aggregated.
+"""
+import functools
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+QUERY_SECONDS = Histogram('autobell_query_seconds', 'SQL statement latency', ['statement'])
+QUERY_ROWS = Histogram('autobell_query_rows', 'Rows returned or affected per SQL statement', ['statement'],
+                       buckets=(0, 1, 10, 100, 1000, 10000, 100000, float('inf')))
+POOL_CHECKOUT_SECONDS = Histogram('autobell_pool_checkout_seconds', 'Time spent waiting for a pooled connection')
+PHASE_SECONDS = Histogram('autobell_etl_phase_seconds', 'ETL phase duration', ['phase'],
+                          buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, float('inf')))
+CALLBACK_SECONDS = Histogram('autobell_callback_seconds', 'Dash callback duration', ['callback'])
+
+
+def sample_rate():
+    return float(os.environ.get('SQL_METRICS_SAMPLE_RATE', '1.0'))
+
+
+def echo_enabled():
+    """Full statement logging is opt-in with SQL_ECHO=1 instead of always on"""
+    return os.environ.get('SQL_ECHO') == '1'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def _statement_kind(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+
+
+def instrument_engine(engine, rate=None):
+    """Record latency and row counts for a sample of the engine's statements"""
+    rate = sample_rate() if rate is None else rate
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if rate >= 1.0 or random.random() < rate:
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+        else:
+            conn.info.setdefault('query_start', []).append(None)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['query_start'].pop()
+        if start is None:
+            return
+        kind = _statement_kind(statement)
+        QUERY_SECONDS.labels(kind).observe(time.perf_counter() - start)
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            QUERY_ROWS.labels(kind).observe(cursor.rowcount)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        # Keep the start stack balanced when a statement fails
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    return engine
+
+
+@contextmanager
+def timed_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.labels(phase).observe(time.perf_counter() - start)
+
+
+def timed(histogram, label):
+    """Decorator observing a function's duration into histogram under label"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.labels(label).observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+def etl_phase(phase):
+    return timed(PHASE_SECONDS, phase)
+
+
+def dash_callback(fn):
+    return timed(CALLBACK_SECONDS, fn.__name__)(fn)
+
+
+def metrics_registry():
+    """The default registry, or a multiprocess collector when running under gunicorn workers"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+def dump_metrics():
+    """Prometheus text exposition of every metric"""
+    return generate_latest(metrics_registry())
@@ -1,19 +1,126 @@
-from sqlalchemy import Column, Date, Integer, Numeric
-from sqlalchemy.orm import declarative_base
+from datetime import date
+
+from sqlalchemy import Column, Date, DateTime, Integer, Numeric, String, Text, UniqueConstraint, func
+from sqlalchemy.orm import Session, declarative_base
 
 
 Base = declarative_base()
 
+DEFAULT_SITE = 'autobell_25'
+
+# Details of the original single-site dashboard, seeded into the sites table
+DEFAULT_SITE_DETAILS = {
+    'site': DEFAULT_SITE,
+    'name': 'Autobell 25',
+    'install_date': date(2022, 4, 7),
+    'valve_install_date': date(2021, 3, 11),
+    'valve': '(1) 2" Fluidlytix Valve',
+    'location': 'Autobell Carwash 25',
+    'address': '8525 Hankins Road, Charlotte, NC 28269',
+    'reclaim_gal': 8800.00,
+    'baseline_months': 13,
+    'annual_water_cost': 31876.00,
+    'solution_cost': 5500.00,
+    'image_url': 'https://bloximages.newyork1.vip.townnews.com/statesville.com/content/tncms/assets/v3/editorial/7/2d/72d254e4-5f1c-5269-92eb-b1fd803969ce/5e90e5d3a2f8a.image.png?crop=1439%2C1439%2C0%2C0&resize=1439%2C1439&order=crop%2Cresize',
+}
+
 def create_tables(engine):
-    """"""
+    """Create any missing tables and make sure the original site is registered"""
     Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        if session.get(AutobellSiteItem, DEFAULT_SITE) is None:
+            session.add(AutobellSiteItem(**DEFAULT_SITE_DETAILS))
+            session.commit()
+
+class AutobellSiteItem(Base):
+    
+    __tablename__ = 'sites'
+    
+    site = Column('site', String, primary_key=True)
+    name = Column('name', String, nullable=False)
+    # Start of the post-install reporting period
+    install_date = Column('install_date', Date, nullable=False)
+    # Install details shown on the site's dashboard tab
+    valve_install_date = Column('valve_install_date', Date, nullable=True)
+    valve = Column('valve', String, nullable=True)
+    location = Column('location', String, nullable=True)
+    address = Column('address', String, nullable=True)
+    image_url = Column('image_url', String, nullable=True)
+    # Savings model; unset values fall back to BASELINE_DEFAULTS in the ETL
+    reclaim_gal = Column('reclaim_gal', Numeric(scale= 2), nullable=True)
+    baseline_months = Column('baseline_months', Integer, nullable=True)
+    annual_water_cost = Column('annual_water_cost', Numeric(scale= 2), nullable=True)
+    solution_cost = Column('solution_cost', Numeric(scale= 2), nullable=True)
+    post_window = Column('post_window', Integer, nullable=True)
+
+
+class AutobellSiteStateItem(Base):
+    """Incremental ETL bookkeeping: high-water mark and cached pre-period (baseline) statistics per site"""
+    
+    __tablename__ = 'etl_site_state'
+    
+    site = Column('site', String, primary_key=True)
+    high_water_mark = Column('high_water_mark', Date, nullable=True)
+    # Install date the pre-period statistics were split on; the state is rebuilt when sites.install_date changes
+    install_date = Column('install_date', Date, nullable=True)
+    pre_count = Column('pre_count', Integer, nullable=False, default=0)
+    pre_cars_sum = Column('pre_cars_sum', Numeric(scale= 2), nullable=False, default=0)
+    pre_usage_sum = Column('pre_usage_sum', Numeric(scale= 2), nullable=False, default=0)
+    # Sums of squares for the baseline variances; NULL in state rows written before
+    # they existed, which are rebuilt on the next run
+    pre_cars_sq_sum = Column('pre_cars_sq_sum', Numeric(scale= 2), nullable=True)
+    pre_usage_sq_sum = Column('pre_usage_sq_sum', Numeric(scale= 2), nullable=True)
+    pre_gal_car_count = Column('pre_gal_car_count', Integer, nullable=True)
+    pre_gal_car_sum = Column('pre_gal_car_sum', Numeric(scale= 2), nullable=True)
+    pre_gal_car_sq_sum = Column('pre_gal_car_sq_sum', Numeric(scale= 2), nullable=True)
+
+
+class AutobellReportVersionItem(Base):
+    """Bumped by every report load so dashboard caches know when to refresh"""
+    
+    __tablename__ = 'report_versions'
+    
+    site = Column('site', String, primary_key=True)
+    version = Column('version', Integer, nullable=False, default=1)
+    updated_at = Column('updated_at', DateTime, nullable=False, server_default=func.now())
+
+
+class AutobellReportFragmentItem(Base):
+    """Dashboard tables, cards and figures pre-rendered to JSON by the report load"""
+    
+    __tablename__ = 'report_fragments'
+    
+    site = Column('site', String, primary_key=True)
+    name = Column('name', String, primary_key=True)
+    version = Column('version', Integer, nullable=False)
+    payload = Column('payload', Text, nullable=False)
+
+
+class AutobellAlertItem(Base):
+    """Meter periods flagged by the anomaly pass, rebuilt on every run"""
+    
+    __tablename__ = 'alerts'
+    __table_args__ = (UniqueConstraint('site', 'start_date', 'kind'),)
+    
+    id = Column('id', Integer, primary_key = True)
+    site = Column('site', String, nullable=False)
+    start_date = Column('start_date', Date, nullable=False)
+    # leak, counter_fault or meter_regression
+    kind = Column('kind', String, nullable=False)
+    value = Column('value', Numeric(scale= 2), nullable=True)
+    expected = Column('expected', Numeric(scale= 2), nullable=True)
+    score = Column('score', Numeric(scale= 2), nullable=True)
+    detected_at = Column('detected_at', DateTime, nullable=False, server_default=func.now())
+
 
 class AutobellItem(Base):
     
     __tablename__ = 'autobell_complete_data'
+    __table_args__ = (UniqueConstraint('site', 'end_date'),)
     
+    site = Column('site', String, primary_key=True, server_default=DEFAULT_SITE)
     start_date = Column('start_date', Date, primary_key=True)
-    end_date = Column('end_date', Date, unique=True, nullable=False)
+    end_date = Column('end_date', Date, nullable=False)
     start_meter_cubic = Column('start_meter_cubic', Numeric(scale= 2), nullable=False)
     end_meter_cubic = Column('end_meter_cubic', Numeric(scale= 2), nullable=False)
     cars = Column('cars', Numeric(scale= 2), nullable=False)
@@ -22,13 +129,12 @@ class AutobellItem(Base):
     start_meter_gal = Column('start_meter_gal', Numeric(scale= 2), nullable=False)
     end_meter_gal = Column('end_meter_gal', Numeric(scale= 2), nullable=False)
     consumption_gal = Column('consumption_gal', Numeric(scale= 2), nullable=False)
-    gallons_car = Column('gallons_car', Numeric(scale= 2), nullable=False)
+    # NULL for periods without cars
+    gallons_car = Column('gallons_car', Numeric(scale= 2), nullable=True)
 
-class AutobellPrePostItem(Base):
-    
-    __tablename__ = 'pre_post_reports'
+class PrePostReportColumns:
+    """Report columns shared by the pre_post_reports history and its current_pre_post_reports rollup"""
     
-    id = Column('id', Integer, primary_key = True)
     date_added = Column('date_added', Date, nullable=False)
     pre_cars = Column('pre_cars', Numeric(scale= 2), nullable = False)
     post_cars= Column('post_cars', Numeric(scale= 2), nullable = False)
@@ -39,28 +145,59 @@ class AutobellPrePostItem(Base):
     pre_gal_cal= Column('pre_gal_cal', Numeric(scale= 2), nullable = False)
     post_gal_car= Column('post_gal_car', Numeric(scale= 2), nullable = False)
     pct_change_gal_car= Column('pct_change_gal_car', Numeric(scale= 2), nullable = False)
-    
 
-class AutobellPaybackItem(Base):
+
+class AutobellPrePostItem(PrePostReportColumns, Base):
     
-    __tablename__ = 'payback_reports'
+    __tablename__ = 'pre_post_reports'
+    __table_args__ = (UniqueConstraint('site', 'date_added'),)
     
     id = Column('id', Integer, primary_key = True)
+    site = Column('site', String, nullable=False, server_default=DEFAULT_SITE)
+
+
+class AutobellCurrentPrePostItem(PrePostReportColumns, Base):
+    """Latest pre_post_reports row per site, kept up to date by every report load"""
+    
+    __tablename__ = 'current_pre_post_reports'
+    
+    site = Column('site', String, primary_key=True)
+    
+
+class PaybackReportColumns:
+    """Report columns shared by the payback_reports history and its current_payback_reports rollup"""
+    
     date_added = Column('date_added', Date, nullable=False)
     annual_water_cost = Column('annual_water_cost', Numeric(scale= 2), nullable = False)
     savings_rate = Column('savings_rate', Numeric(scale= 2), nullable = False)
     monthly_savings = Column('monthly_savings', Numeric(scale= 2), nullable = False)
     annual_savings= Column('annual_savings', Numeric(scale= 2), nullable = False)
     savings_ten= Column('savings_ten', Numeric(scale= 2), nullable = False)
-    breakeven_months= Column('breakeven_months', Numeric(scale= 2), nullable = False)
+    # NULL when the savings never pay the solution back
+    breakeven_months= Column('breakeven_months', Numeric(scale= 2), nullable = True)
     fluidlytix_cost = Column('fluidlytix_cost', Numeric(scale= 2), nullable = False)
-    
 
-class AutobellCashFlowItem(Base):
+
+class AutobellPaybackItem(PaybackReportColumns, Base):
     
-    __tablename__ = 'cashflow_reports'
+    __tablename__ = 'payback_reports'
+    __table_args__ = (UniqueConstraint('site', 'date_added'),)
     
     id = Column('id', Integer, primary_key = True)
+    site = Column('site', String, nullable=False, server_default=DEFAULT_SITE)
+
+
+class AutobellCurrentPaybackItem(PaybackReportColumns, Base):
+    """Latest payback_reports row per site, kept up to date by every report load"""
+    
+    __tablename__ = 'current_payback_reports'
+    
+    site = Column('site', String, primary_key=True)
+    
+
+class CashFlowReportColumns:
+    """Report columns shared by the cashflow_reports history and its current_cashflow_reports rollup"""
+    
     date_added = Column('date_added', Date, nullable=False)
     project_install = Column('project_install', Numeric(scale= 2), nullable = False)
     year_1 = Column('year_1', Numeric(scale= 2), nullable = False)
@@ -72,4 +209,21 @@ class AutobellCashFlowItem(Base):
     year_7 = Column('year_7', Numeric(scale= 2), nullable = False)
     year_8 = Column('year_8', Numeric(scale= 2), nullable = False)
     year_9 = Column('year_9', Numeric(scale= 2), nullable = False)
-    year_10 = Column('year_10', Numeric(scale= 2), nullable = False)
\ No newline at end of file
+    year_10 = Column('year_10', Numeric(scale= 2), nullable = False)
+
+
+class AutobellCashFlowItem(CashFlowReportColumns, Base):
+    
+    __tablename__ = 'cashflow_reports'
+    __table_args__ = (UniqueConstraint('site', 'date_added'),)
+    
+    id = Column('id', Integer, primary_key = True)
+    site = Column('site', String, nullable=False, server_default=DEFAULT_SITE)
+
+
+class AutobellCurrentCashFlowItem(CashFlowReportColumns, Base):
+    """Latest cashflow_reports row per site, kept up to date by every report load"""
+    
+    __tablename__ = 'current_cashflow_reports'
+    
+    site = Column('site', String, primary_key=True)
@@ -0,0 +1,136 @@
+"""
+Typed reads for the Numeric(scale=2) models.
+
+pd.read_sql infers dtypes row by row and can leave NUMERIC columns as object
+arrays of Decimal; these helpers coerce every column to an explicit dtype
+derived from the model, either float64 or scaled integer cents (int64), so
+aggregations stay vectorized. ColumnarCache optionally keeps typed meter
+history on disk as Feather files, so repeated full-history reads only query
+the periods added since.
+"""
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, DateTime, Integer, Numeric, String, Text, text
+
+from common.models import AutobellItem
+
+
+# Directory of the meter history cache; unset disables it
+HISTORY_CACHE_DIR = os.environ.get('AUTOBELL_HISTORY_CACHE')
+
+HISTORY_QUERY = text("SELECT * FROM autobell_complete_data WHERE site = :site AND start_date > :after ORDER BY start_date;")
+
+
+def dtype_map(model, numeric='float64'):
+    """
+    Column name -> pandas dtype for a model; numeric='cents' maps
+    Numeric(scale=2) columns to int64 hundredths instead of float64
+    """
+    dtypes = {}
+    for column in model.__table__.columns:
+        if isinstance(column.type, Numeric):
+            dtypes[column.name] = 'cents' if numeric == 'cents' and column.type.scale == 2 else 'float64'
+        elif isinstance(column.type, Integer):
+            dtypes[column.name] = 'Int64' if column.nullable else 'int64'
+        elif isinstance(column.type, (Date, DateTime)):
+            dtypes[column.name] = 'datetime64[ns]'
+        elif isinstance(column.type, (String, Text)):
+            dtypes[column.name] = 'object'
+    return dtypes
+
+
+def coerce(frame, dtypes):
+    """Cast the frame's columns in place to the mapped dtypes, ignoring columns it doesn't have"""
+    for name, dtype in dtypes.items():
+        if name not in frame.columns:
+            continue
+        if dtype == 'cents':
+            frame[name] = np.rint(pd.to_numeric(frame[name]).astype('float64') * 100).astype('int64')
+        elif dtype == 'datetime64[ns]':
+            frame[name] = pd.to_datetime(frame[name])
+        elif dtype == 'float64':
+            frame[name] = pd.to_numeric(frame[name]).astype('float64')
+        else:
+            frame[name] = frame[name].astype(dtype)
+    return frame
+
+
+def read_typed(sql, connection, model, params=None, numeric='float64'):
+    """pd.read_sql with every column of model coerced to its mapped dtype"""
+    frame = pd.read_sql(sql, connection, params=params)
+    return coerce(frame, dtype_map(model, numeric))
+
+
+class ColumnarCache:
+    """
+    Optional on-disk cache of typed meter history, one Feather file per site.
+
+    Needs pyarrow; without it the cache is disabled and callers read straight
+    from the database. Ingest drops a site's file when it merges periods at or
+    before the last cached one (see invalidate_from).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            import pyarrow  # noqa: F401
+            self.enabled = True
+        except ImportError:
+            self.enabled = False
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, site):
+        return os.path.join(self.directory, f'{site}.feather')
+
+    def load(self, site):
+        if not self.enabled or not os.path.exists(self._path(site)):
+            return None
+        return pd.read_feather(self._path(site))
+
+    def store(self, site, frame):
+        if self.enabled:
+            frame.reset_index(drop=True).to_feather(self._path(site))
+
+    def invalidate(self, site):
+        if self.enabled and os.path.exists(self._path(site)):
+            os.remove(self._path(site))
+
+    def invalidate_from(self, site, start_date):
+        """
+        Drop the site's cached history when it reaches start_date, i.e. when
+        periods from start_date on were backfilled or corrected. Periods
+        appended after the cached ones are picked up without invalidating.
+        """
+        if not self.enabled or not os.path.exists(self._path(site)):
+            return
+        cached = pd.read_feather(self._path(site), columns=['start_date'])
+        if len(cached) and cached.start_date.max() >= pd.Timestamp(start_date):
+            self.invalidate(site)
+
+
+def history_cache():
+    """The ColumnarCache in AUTOBELL_HISTORY_CACHE, or None when it isn't configured"""
+    return ColumnarCache(HISTORY_CACHE_DIR) if HISTORY_CACHE_DIR else None
+
+
+def read_meter_history(session, site, cache=None, numeric='float64'):
+    """
+    A site's full typed meter history. With a ColumnarCache only the periods
+    after the cached ones are queried.
+    """
+    cached = cache.load(site) if cache is not None else None
+    after = cached.start_date.max().date() if cached is not None and len(cached) else date.min
+    new = read_typed(HISTORY_QUERY, session.connection(), AutobellItem, {'site': site, 'after': after}, numeric)
+
+    if cached is None:
+        history = new
+    else:
+        history = pd.concat([cached, new], ignore_index=True)
+    if cache is not None and len(new):
+        cache.store(site, history)
+
+    return history
@@ -0,0 +1,115 @@
+"""
+Vendor the dashboard's remote images into assets/vendor with content-hashed names.
+
+    python -m dashboard.assets [--from-sites] [extra image URLs...]
+
+Heroku builds run this from bin/post_compile, so every slug ships with the
+images; running it locally and committing assets/vendor and
+dashboard/asset_manifest.json works too. The manifest maps each remote URL to
+its fingerprinted copy, which the app serves with a year-long cache header.
+Images missing from the manifest keep loading from their remote URLs.
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.request
+from urllib.parse import urlparse
+
+from common.models import DEFAULT_SITE_DETAILS
+
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+VENDOR_DIR = os.path.join(ASSETS_DIR, 'vendor')
+# Kept out of assets/ so Dash doesn't serve it
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'asset_manifest.json')
+VENDOR_URL = '/assets/vendor/'
+
+LOGOS = {
+    'fluidlytix_logo': "https://static.wixstatic.com/media/160184_ad4c1492eb71433cab12f62ad924a4ef~mv2.png/v1/crop/x_0,y_0,w_600,h_499/fill/w_210,h_174,al_c,q_85,usm_0.66_1.00_0.01,enc_auto/FluidLytix-Logo.png",
+    'pws_logo': "https://pristineworldsolutions.com/wp-content/uploads/2021/03/big-logo.png",
+}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Remote URL -> vendored file name; empty when nothing has been vendored"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_manifest = load_manifest()
+
+
+def vendored(url):
+    """The fingerprinted local copy of a remote image, or the remote URL itself"""
+    if url in _manifest:
+        return VENDOR_URL + _manifest[url]
+    return url
+
+
+def _extension(url, content_type):
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if extension in ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp'):
+        return extension
+    return mimetypes.guess_extension((content_type or '').split(';')[0].strip()) or '.img'
+
+
+def vendor(url, directory=VENDOR_DIR, timeout=30):
+    """Download one image and store it as <name>.<sha256 prefix><ext>, returning the file name"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        content = response.read()
+        content_type = response.headers.get('Content-Type')
+
+    stem = os.path.splitext(os.path.basename(urlparse(url).path))[0] or 'image'
+    name = f'{stem[:40]}.{hashlib.sha256(content).hexdigest()[:12]}{_extension(url, content_type)}'
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(content)
+
+    return name
+
+
+def site_image_urls():
+    from sqlalchemy import text
+
+    from common.heroku_psql import get_connector
+
+    with get_connector(external=True, pool_size=1, max_overflow=0).Session as session:
+        return list(session.execute(text("SELECT DISTINCT image_url FROM sites WHERE image_url IS NOT NULL;")).scalars())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vendor and fingerprint the dashboard images into assets/vendor')
+    parser.add_argument('urls', nargs='*', help='Extra image URLs to vendor')
+    parser.add_argument('--from-sites', action='store_true', help='Also vendor every image_url in the sites table')
+    args = parser.parse_args()
+
+    urls = [*LOGOS.values(), DEFAULT_SITE_DETAILS['image_url'], *args.urls]
+    if args.from_sites:
+        urls += site_image_urls()
+
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    manifest = load_manifest()
+    for url in dict.fromkeys(urls):
+        try:
+            manifest[url] = vendor(url)
+        except OSError as e:
+            print(f'{url}: {e!r}, keeping the remote URL')
+            continue
+        print(f'{manifest[url]}\t{url}')
+
+    # Drop fingerprinted files the manifest no longer points at
+    keep = set(manifest.values())
+    for name in os.listdir(VENDOR_DIR):
+        if name not in keep and not name.startswith('.'):
+            os.remove(os.path.join(VENDOR_DIR, name))
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+from dash import dcc, html, dash_table
+from dash.dash_table.Format import Format, Group, Scheme
+
+import dash_bootstrap_components as dbc 
+import pandas as pd
+import plotly.express as px
+
+from autobell_etl.etl.anomalies import ALERT_LABELS
+from dashboard.assets import vendored
+
+
+METER_READS_PAGE_SIZE = 25
+
+def _long_date(value):
+    return f'{value:%B} {value.day}, {value.year}' if pd.notna(value) else 'N/A'
+
+def _text(value, default=''):
+    return value if pd.notna(value) and value else default
+
+def construct_install_content(site):
+    """
+    Installation Details card for a row of the sites table
+    """
+    
+    install_date = site.valve_install_date if pd.notna(site.valve_install_date) else site.install_date
+    details = f"""
+        **Valve:** {_text(site.valve, 'N/A')}
+        
+        **Install Date:** {_long_date(install_date)}  
+        
+        **Post-Install Reporting Start Date:** {_long_date(site.install_date)}
+        
+        **Location:**  
+        
+        _{_text(site.location, site['name'])}_  
+        
+        _{_text(site.address)}_  
+        """
+    image = [dbc.CardImg(src=vendored(site.image_url), className='mt-3 mb-3'), html.Hr()] if _text(site.image_url) else []
+    
+    install_content = dbc.Card([
+        dbc.CardHeader('Installation Details', className="card-header"),
+        dbc.CardBody([dcc.Markdown(details), html.Hr(), *image])
+        ], className='mt-3')
+    
+    return install_content
+
+def constrcut_all_table():
+    """
+    Meter Reads table; rows are fetched a page at a time by update_meter_reads and formatted in the browser
+    """
+    number = Format(precision=2, scheme=Scheme.fixed, group=Group.yes)
+    columns = [
+        {'name': 'Start Date', 'id': 'start_date', 'type': 'datetime'},
+        {'name': 'End Date', 'id': 'end_date', 'type': 'datetime'},
+        {'name': 'Cars', 'id': 'cars', 'type': 'numeric', 'format': number},
+        {'name': 'Usage (Cubic)', 'id': 'consumption_cubic', 'type': 'numeric', 'format': number},
+        {'name': 'Usage (Gallon)', 'id': 'consumption_gal', 'type': 'numeric', 'format': number},
+        {'name': 'Gal/Car', 'id': 'gallons_car', 'type': 'numeric', 'format': number},
+        ]
+
+    all_data_table = dash_table.DataTable(
+        id='meter-reads-table',
+        columns=columns,
+        page_current=0,
+        page_size=METER_READS_PAGE_SIZE,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+        style_cell={'textAlign': 'right'},
+        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': 'rgb(248, 248, 248)'}],
+        )
+    
+    return all_data_table
+
+def construct_payback_table(payback_df):
+        
+    payback_df[['annual_water_cost', 'monthly_savings', 'annual_savings','savings_ten', 'fluidlytix_cost']] = payback_df[['annual_water_cost', 'monthly_savings', 'annual_savings','savings_ten', 'fluidlytix_cost']].applymap('${:,.2f}'.format)
+    payback_df['savings_rate']=payback_df['savings_rate'].map('{:.2f}%'.format)
+    payback_df['breakeven_months'] = payback_df['breakeven_months'].map('{:,.2f}'.format, na_action='ignore').where(payback_df['breakeven_months'].notna(), 'Never')
+    payback_df = payback_df.rename(columns=
+                                        {'annual_water_cost': 'Annual Water Bill', 
+                                            'savings_rate': 'Savings Rate',
+                                            'monthly_savings': 'Monthly Savings',
+                                            'annual_savings': 'Annual Savings',
+                                            'savings_ten': '10-Year Savings',
+                                            'breakeven_months': 'Breakeven Point (Months)',
+                                            'fluidlytix_cost': 'Water Savings Solution'})
+    payback_table = dbc.Table.from_dataframe(payback_df, striped=True, bordered=True, hover=True, className='mt-4 mb-4')
+    
+    return payback_table
+
+def construct_cashflow_graph(cashflow_df):
+    
+    cashflow_graph = px.bar(cashflow_df.loc[0] , x = cashflow_df.columns.to_list(), y= cashflow_df.loc[0])
+    cashflow_graph.update_layout(
+        xaxis=dict(
+            title = None,
+            tickmode = 'array',
+            tickvals = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+            ticktext = [x.title().replace('_', ' ') for x in cashflow_df.columns.to_list()],
+            tickangle= 45
+        ),
+        yaxis=dict(
+            title = 'Cash Flow ($)',
+            showticklabels = True,
+            hoverformat = '$,.2f',
+            tickformat = ',.0f'),
+        margin=dict(l=20, r=20, t=20, b=20))
+    
+    return cashflow_graph
+
+TREND_MEASURES = {'gal_car': 'Gal/Car', 'usage': 'Usage (Gallon)', 'cars': 'Cars'}
+
+def construct_trend_graph(series_df, measure='gal_car'):
+    
+    trend_graph = px.line(series_df, x='period', y=measure, color='site', markers=True)
+    trend_graph.update_layout(
+        xaxis=dict(title = None),
+        yaxis=dict(
+            title = TREND_MEASURES[measure],
+            hoverformat = ',.2f',
+            tickformat = ',.0f'),
+        showlegend = series_df.site.nunique() > 1,
+        margin=dict(l=20, r=20, t=20, b=20))
+    
+    return trend_graph
+
+def construct_trend_controls():
+    
+    trend_controls = dbc.Row([
+        dbc.Col(dbc.RadioItems(id='trend-resolution', inline=True, value='month',
+                               options=[{'label': x.title(), 'value': x} for x in ('week', 'month', 'quarter', 'year')])),
+        dbc.Col(dbc.RadioItems(id='trend-measure', inline=True, value='gal_car',
+                               options=[{'label': label, 'value': value} for value, label in TREND_MEASURES.items()])),
+        ], className='mt-3')
+    
+    return trend_controls
+
+def construct_alerts_table(alerts_df):
+    """
+    Periods flagged by the anomaly pass, newest first
+    """
+    
+    if alerts_df.empty:
+        return dbc.Alert('No anomalies detected in the meter reads.', color='success', className='mt-3')
+    
+    alerts_df['start_date'] = alerts_df.start_date.dt.strftime('%Y-%m-%d')
+    alerts_df['kind'] = alerts_df.kind.map(ALERT_LABELS).fillna(alerts_df.kind)
+    alerts_df[['value', 'expected']] = alerts_df[['value', 'expected']].applymap('{:,.2f}'.format)
+    alerts_df['score'] = alerts_df.score.map('{:+.1f}σ'.format).where(alerts_df.score.notna(), '')
+    alerts_df = alerts_df.rename(columns=
+                                    {'start_date': 'Period Start',
+                                     'kind': 'Alert',
+                                     'value': 'Reading',
+                                     'expected': 'Expected',
+                                     'score': 'Z-Score'})
+    alerts_table = dbc.Table.from_dataframe(alerts_df, striped=True, bordered=True, hover=True, className='mt-4 mb-4')
+    
+    return alerts_table
+
+def construct_savings_card(pre_post_df):
+    
+    savings_card=dbc.Card([
+        dbc.CardHeader("Fluidlytix Savings Rate", className="card-header"),
+        dbc.CardBody([
+            dcc.Markdown(
+                f'''
+                ## {'{:.2f}%'.format(pre_post_df.pct_change_gal_car[0])}
+                ''',style={'textAlign': 'center'}
+                ),
+            ]),
+        dbc.CardFooter('Target: 15.00%'),
+        ],
+         className="card border-success mt-3",
+    )
+
+    return savings_card
+
+def construct_cars_card(pre_post_df):
+    
+    cars_card=dbc.Card(
+        [
+            dbc.CardHeader("Cars Serviced", className="card-header"),
+            dbc.CardBody(
+                [
+                    dcc.Markdown(
+                        f'''
+                        ## {'{:,.2f}'.format(pre_post_df.post_cars[0])}
+                        ''',
+                        style={'textAlign': 'center'}
+                    )
+                ]
+            ),
+            dbc.CardFooter(f"↑ {'{:,.2f}'.format(abs(pre_post_df.total_change_cars[0]))} ({'{:,.2f}'.format(pre_post_df.pre_cars[0])})", className="card-footer"),
+        ],
+         className="card border-success mt-3",
+    )
+
+    return cars_card
+
+def construct_usage_card(pre_post_df):
+    
+    usage_card=dbc.Card(
+        [
+            dbc.CardHeader("Usage Gallons", className="card-header"),
+            dbc.CardBody(
+                [
+                    dcc.Markdown(
+                        f'''
+                        ## {'{:,.2f}'.format(pre_post_df.post_usage[0])}
+                        ''',
+                        style={'textAlign': 'center'}
+                    )
+                ]
+            ),
+            dbc.CardFooter(f"↓ {'{:,.2f}'.format(abs(pre_post_df.total_change_usage[0]))} ({'{:,.2f}'.format(pre_post_df.pre_usage[0])})", className="card-footer"),
+        ],
+         className="card border-success mt-3",
+    )
+
+    return usage_card
+
+def construct_gal_car_card(pre_post_df):
+    
+    gal_car_card=dbc.Card(
+        [
+            dbc.CardHeader("Gallons per Car", className="card-header"),
+            dbc.CardBody(
+                [
+                    dcc.Markdown(
+                        f'''
+                        ## {'{:.2f}'.format(pre_post_df.post_gal_car[0])}
+                        ''',
+                        style={'textAlign': 'center'})
+                ]
+            ),
+            dbc.CardFooter(f"↓ {'{:.2f}%'.format(pre_post_df.pct_change_gal_car[0])} ({'{:.2f}'.format(pre_post_df.pre_gal_cal[0])})", className="card-footer"),
+        ],
+         className="card border-success mt-3",
+    )
+
+    return gal_car_card
@@ -0,0 +1,272 @@
+import functools
+import json
+import math
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import text
+
+from common.heroku_psql import InternalHerokuDBConnector
+from common.models import (DEFAULT_SITE, AutobellAlertItem, AutobellCurrentCashFlowItem, AutobellCurrentPaybackItem,
+                           AutobellCurrentPrePostItem, AutobellItem)
+from common.typed_read import read_typed
+from dashboard.timeseries import usage_series
+
+
+# Latest report per site, each a primary key lookup on the current_* rollups
+QUERIES = {
+    'pre_post': "SELECT * FROM current_pre_post_reports WHERE site = :site;",
+    'payback': """
+        SELECT annual_water_cost, savings_rate, monthly_savings, annual_savings, savings_ten, breakeven_months, fluidlytix_cost 
+        FROM current_payback_reports WHERE site = :site;""",
+    'cashflow': """
+        SELECT project_install, year_1, year_2, year_3, year_4, year_5, year_6, year_7, year_8, year_9, year_10 
+        FROM current_cashflow_reports WHERE site = :site;""",
+}
+
+QUERY_MODELS = {
+    'pre_post': AutobellCurrentPrePostItem,
+    'payback': AutobellCurrentPaybackItem,
+    'cashflow': AutobellCurrentCashFlowItem,
+}
+
+SITES_QUERY = text("""
+    SELECT site, name, install_date, valve_install_date, valve, location, address, image_url
+    FROM sites ORDER BY name;""")
+
+ALERTS_QUERY = text("""
+    SELECT start_date, kind, value, expected, score FROM alerts
+    WHERE site = :site ORDER BY start_date DESC, kind LIMIT :limit;""")
+
+SITE_VERSIONS_QUERY = text("SELECT site, version FROM report_versions;")
+
+FRAGMENTS_QUERY = text("SELECT name, payload FROM report_fragments WHERE site = :site AND version = :version;")
+
+METER_READ_COLUMNS = ['start_date', 'end_date', 'cars', 'consumption_cubic', 'consumption_gal', 'gallons_car']
+
+# Parses a comparison filter value into the column's type, raising ValueError when it can't
+FILTER_VALUE_TYPES = {
+    'start_date': date.fromisoformat,
+    'end_date': date.fromisoformat,
+    'cars': float,
+    'consumption_cubic': float,
+    'consumption_gal': float,
+    'gallons_car': float,
+}
+
+# DataTable filter operators and the SQL they translate to
+FILTER_OPERATORS = {
+    'eq': '=', '=': '=',
+    'ne': '<>', '!=': '<>',
+    'lt': '<', '<': '<',
+    'le': '<=', '<=': '<=',
+    'gt': '>', '>': '>',
+    'ge': '>=', '>=': '>=',
+    'contains': 'LIKE',
+    'datestartswith': 'LIKE',
+}
+
+
+def _parse_filter(filter_query):
+    """
+    Translate a DataTable filter_query such as '{cars} > 100 && {start_date} datestartswith 2022'
+    into a SQL condition list and bound parameters. Unknown columns and operators, and comparison
+    values that don't parse as the column's type (a number, or an ISO date), are ignored.
+    """
+    conditions, params = [], {}
+    for i, part in enumerate(filter(None, (filter_query or '').split(' && '))):
+        try:
+            column, rest = part.split('}', 1)
+            operator, value = rest.strip().split(' ', 1)
+        except ValueError:
+            continue
+        column = column.strip().lstrip('{')
+        if column not in METER_READ_COLUMNS or operator not in FILTER_OPERATORS:
+            continue
+
+        value = value.strip().strip('"\'')
+        key = f'filter_{i}'
+        if operator in ('contains', 'datestartswith'):
+            conditions.append(f'CAST({column} AS TEXT) LIKE :{key}')
+            params[key] = f'%{value}%' if operator == 'contains' else f'{value}%'
+        else:
+            try:
+                value = FILTER_VALUE_TYPES[column](value)
+            except ValueError:
+                continue
+            if isinstance(value, float) and not math.isfinite(value):
+                continue
+            conditions.append(f'{column} {FILTER_OPERATORS[operator]} :{key}')
+            params[key] = value
+
+    return conditions, params
+
+
+def _order_by(sort_by):
+    """ORDER BY clause for DataTable sort_by, always ending on start_date so pages are stable"""
+    terms = [f"{sort['column_id']} {'DESC' if sort['direction'] == 'desc' else 'ASC'}"
+             for sort in sort_by or [] if sort['column_id'] in METER_READ_COLUMNS]
+    if not any(term.startswith('start_date ') for term in terms):
+        terms.append('start_date ASC')
+
+    return ', '.join(terms)
+
+
+class DashboardData:
+    """
+    Lazily loaded, TTL cached result sets for the dashboard.
+
+    Nothing touches the database until the first request. Each result set is
+    kept for `ttl` seconds, and the whole cache is dropped as soon as the ETL
+    bumps report_versions (polled at most every `version_poll` seconds), so
+    new reports show up without restarting the workers.
+    """
+
+    def __init__(self, connector_factory=InternalHerokuDBConnector, ttl=600, version_poll=30, fragment_cache_size=256):
+        self._connector_factory = connector_factory
+        self._connector = None
+        self.ttl = ttl
+        self.version_poll = version_poll
+        self._cache = {}
+        self._version = None
+        self._site_versions = {}
+        self._version_checked = 0.0
+        self._lock = threading.RLock()
+        # Keyed on (site, version), so a new report is simply a cache miss
+        self._fragments = functools.lru_cache(maxsize=fragment_cache_size)(self._load_fragments)
+
+    @property
+    def connector(self):
+        with self._lock:
+            if self._connector is None:
+                self._connector = self._connector_factory()
+            return self._connector
+
+    def invalidate(self, name=None):
+        """Drop one named result set for every site, or everything"""
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                for key in [key for key in self._cache if key[0] == name]:
+                    del self._cache[key]
+
+    def report_version(self):
+        """Current report version, re-read from the database at most every version_poll seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_poll:
+                return self._version
+
+        with self.connector.Session as session:
+            site_versions = dict(session.execute(SITE_VERSIONS_QUERY).all())
+        version = sum(site_versions.values())
+
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+            self._version = version
+            self._site_versions = site_versions
+            self._version_checked = now
+            return version
+
+    def site_version(self, site):
+        self.report_version()
+        return self._site_versions.get(site)
+
+    def _load_fragments(self, site, version):
+        with self.connector.Session as session:
+            rows = session.execute(FRAGMENTS_QUERY, {'site': site, 'version': version}).all()
+
+        return {name: json.loads(payload) for name, payload in rows}
+
+    def fragments(self, site):
+        """
+        Pre-rendered fragments for the site's current report version, from an
+        LRU cache; empty when the ETL hasn't rendered this version
+        """
+        version = self.site_version(site)
+        if version is None:
+            return {}
+
+        return self._fragments(site, version)
+
+    def cached(self, name, loader):
+        """Return loader()'s result from the cache, calling it when missing or expired"""
+        self.report_version()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(name)
+            if hit is not None and hit[0] > now:
+                return hit[1]
+
+        value = loader()
+        with self._lock:
+            self._cache[name] = (now + self.ttl, value)
+        return value
+
+    def get(self, name, site=DEFAULT_SITE):
+        """A copy of the named result set for a site, since the table builders format columns in place"""
+
+        def load():
+            with self.connector.Session as session:
+                return read_typed(text(QUERIES[name]), session.connection(), QUERY_MODELS[name], {'site': site})
+
+        return self.cached((name, site), load).copy()
+
+    def sites(self):
+        """Cached sites table, one row per dashboard tab"""
+
+        def load():
+            with self.connector.Session as session:
+                return pd.read_sql(SITES_QUERY, session.connection(), parse_dates=['install_date', 'valve_install_date'])
+
+        return self.cached(('sites',), load).copy()
+
+    def alerts(self, site=DEFAULT_SITE, limit=50):
+        """The site's most recent alerts; these change with ingests rather than reports, so only the TTL refreshes them"""
+
+        def load():
+            with self.connector.Session as session:
+                return read_typed(ALERTS_QUERY, session.connection(), AutobellAlertItem, {'site': site, 'limit': limit})
+
+        return self.cached(('alerts', site, limit), load).copy()
+
+    def series(self, sites=(DEFAULT_SITE,), resolution='month'):
+        """Cached usage, cars and gal/car series, see dashboard.timeseries.usage_series"""
+
+        def load():
+            with self.connector.Session as session:
+                return usage_series(session, sites, resolution)
+
+        return self.cached(('series', tuple(sites), resolution), load).copy()
+
+    def meter_reads_page(self, page_current=0, page_size=25, sort_by=None, filter_query='', site=DEFAULT_SITE):
+        """
+        One page of meter reads plus the total page count, sorted and filtered in Postgres
+        so only the visible rows leave the database.
+        """
+        conditions, params = _parse_filter(filter_query)
+        where = ' AND '.join(['site = :site'] + conditions)
+        params.update(site=site, limit=page_size, offset=page_current * page_size)
+
+        page_query = text(f"""
+            SELECT {', '.join(METER_READ_COLUMNS)} FROM autobell_complete_data
+            WHERE {where}
+            ORDER BY {_order_by(sort_by)}
+            LIMIT :limit OFFSET :offset;""")
+        count_query = text(f"SELECT COUNT(*) FROM autobell_complete_data WHERE {where};")
+
+        with self.connector.Session as session:
+            page = read_typed(page_query, session.connection(), AutobellItem, params)
+            total = session.execute(count_query, params).scalar()
+
+        page['start_date'] = page.start_date.dt.strftime('%Y-%m-%d')
+        page['end_date'] = page.end_date.dt.strftime('%Y-%m-%d')
+
+        return page, max(1, -(-total // page_size))
+
+
+dashboard_data = DashboardData()
@@ -0,0 +1,156 @@
+import csv
+import io
+import os
+import tempfile
+import zlib
+from datetime import date
+
+from sqlalchemy import func, select
+
+from common.heroku_psql import get_connector
+from common.models import AutobellCashFlowItem, AutobellItem, AutobellPaybackItem, AutobellPrePostItem
+
+
+# Exportable tables and the date column each is filtered and ordered on
+EXPORTS = {
+    'meter_reads': (AutobellItem, 'start_date'),
+    'pre_post_reports': (AutobellPrePostItem, 'date_added'),
+    'payback_reports': (AutobellPaybackItem, 'date_added'),
+    'cashflow_reports': (AutobellCashFlowItem, 'date_added'),
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Rows fetched from the server-side cursor per round trip
+EXPORT_CHUNK_ROWS = 5000
+# Long exports hold a connection for their whole download, so they get their own pool,
+# one connection per gunicorn thread so every concurrent export can check one out
+EXPORT_POOL_SIZE = int(os.environ.get('GUNICORN_THREADS', 4))
+# Give up (before any response is sent) when the pool is still exhausted after this long
+EXPORT_POOL_TIMEOUT = 10
+
+# An XLSX workbook is written out whole before its first byte is sent, and Heroku's
+# router drops a request that sends nothing for 30 s, so XLSX is for small exports
+# (a site or a date range) and anything larger has to be CSV, which streams as it goes
+XLSX_EXPORT_MAX_ROWS = 100000
+FILE_CHUNK_BYTES = 64 * 1024
+
+
+def export_connector():
+    """Connector over the export pool, separate from the one serving the dashboard"""
+    return get_connector(pool_size=EXPORT_POOL_SIZE, max_overflow=0, pool_timeout=EXPORT_POOL_TIMEOUT)
+
+
+def _date(value, name):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date (YYYY-MM-DD), got {value!r}')
+
+
+def export_query(dataset, sites=None, start=None, end=None):
+    """
+    SELECT for a dataset in EXPORTS, optionally limited to some sites and an
+    inclusive date range, ordered by site and date
+    """
+    item, date_column = EXPORTS[dataset]
+    table = item.__table__
+    query = select(*[column for column in table.columns if column.name != 'id'])
+
+    start, end = _date(start, 'start'), _date(end, 'end')
+    if sites:
+        query = query.where(table.c.site.in_(list(sites)))
+    if start is not None:
+        query = query.where(table.c[date_column] >= start)
+    if end is not None:
+        query = query.where(table.c[date_column] <= end)
+
+    return query.order_by(table.c.site, table.c[date_column])
+
+
+def count_rows(connection, query):
+    """Number of rows an export query returns"""
+    return connection.execute(select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+
+
+def stream_rows(connection, query, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yield the column names, then lists of at most chunk_rows rows read
+    through a server-side cursor, so only one chunk is in memory at a time.
+
+    The connection is checked out by the caller, before the response starts,
+    and closed by it once the response is done.
+    """
+    result = connection.execution_options(stream_results=True, yield_per=chunk_rows).execute(query)
+    yield list(result.keys())
+    for partition in result.partitions(chunk_rows):
+        yield partition
+
+
+def csv_chunks(connection, query):
+    """CSV text, one encoded chunk per partition of rows"""
+    rows = stream_rows(connection, query)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(next(rows))
+    for partition in rows:
+        writer.writerows(partition)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of byte chunks as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def xlsx_chunks(connection, query, sheet_name='export'):
+    """
+    An XLSX workbook written row by row with xlsxwriter's constant_memory mode
+    to a temporary file, then streamed back in fixed-size chunks. Nothing is
+    sent until the whole workbook is written, callers keep the query under
+    XLSX_EXPORT_MAX_ROWS.
+    """
+    import xlsxwriter
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+        worksheet = workbook.add_worksheet(sheet_name)
+        rows = stream_rows(connection, query)
+        worksheet.write_row(0, 0, next(rows))
+
+        row_number = 1
+        for partition in rows:
+            for row in partition:
+                worksheet.write_row(row_number, 0, row)
+                row_number += 1
+        workbook.close()
+
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(FILE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_chunks(connection, query, fmt, sheet_name='export'):
+    """Response body chunks for an export in one of EXPORT_FORMATS"""
+    if fmt == 'xlsx':
+        return xlsx_chunks(connection, query, sheet_name)
+    return csv_chunks(connection, query)
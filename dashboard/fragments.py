@@ -0,0 +1,53 @@
+import json
+
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+from autobell_etl.etl.projections import cashflow_columns
+from dashboard.components import (construct_payback_table, construct_cashflow_graph, construct_savings_card,
+                                  construct_cars_card, construct_usage_card, construct_gal_car_card)
+
+
+PAYBACK_COLUMNS = ['annual_water_cost', 'savings_rate', 'monthly_savings', 'annual_savings', 'savings_ten',
+                   'breakeven_months', 'fluidlytix_cost']
+
+FRAGMENT_NAMES = ('payback_table', 'cashflow_graph', 'savings_card', 'cars_card', 'usage_card', 'gal_car_card')
+
+
+def build_fragments(pre_post_df, payback_df, cashflow_df):
+    """Every per-site report fragment as Dash components / figures"""
+
+    return {'payback_table': construct_payback_table(payback_df[PAYBACK_COLUMNS].copy()),
+            'cashflow_graph': construct_cashflow_graph(cashflow_df[cashflow_columns()].copy()),
+            'savings_card': construct_savings_card(pre_post_df),
+            'cars_card': construct_cars_card(pre_post_df),
+            'usage_card': construct_usage_card(pre_post_df),
+            'gal_car_card': construct_gal_car_card(pre_post_df)}
+
+
+def render_fragments(bundle):
+    """Serialize a report bundle's fragments to JSON strings for report_fragments"""
+    fragments = build_fragments(pd.DataFrame([bundle['pre_post']]),
+                                pd.DataFrame([bundle['payback']]),
+                                pd.DataFrame([bundle['cashflow']]))
+
+    return {name: json.dumps(fragment, cls=PlotlyJSONEncoder) for name, fragment in fragments.items()}
+
+
+def site_fragments(data, site):
+    """
+    A site's fragments from the pre-rendered cache, rebuilt from the report
+    tables when the current version hasn't been rendered.
+
+    Pre-rendered fragments are plain JSON dicts, which Dash serves as-is.
+    Returns None for a site without any reports yet.
+    """
+    fragments = data.fragments(site)
+    if set(FRAGMENT_NAMES) <= set(fragments):
+        return fragments
+
+    pre_post_df, payback_df, cashflow_df = (data.get(name, site) for name in ('pre_post', 'payback', 'cashflow'))
+    if pre_post_df.empty or payback_df.empty or cashflow_df.empty:
+        return None
+
+    return build_fragments(pre_post_df, payback_df, cashflow_df)
@@ -0,0 +1,36 @@
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+
+RESOLUTIONS = ('week', 'month', 'quarter', 'year')
+
+SERIES_DTYPES = {'usage': 'float64', 'cars': 'float64', 'gal_car': 'float64'}
+
+SERIES_QUERY = text("""
+    SELECT site,
+           date_trunc(:resolution, start_date)::date AS period,
+           SUM(consumption_gal) AS usage,
+           SUM(cars) AS cars,
+           SUM(consumption_gal) / NULLIF(SUM(cars), 0) AS gal_car
+    FROM autobell_complete_data
+    WHERE site IN :sites AND start_date >= :start AND start_date < :end
+    GROUP BY site, period
+    ORDER BY site, period;""").bindparams(bindparam('sites', expanding=True))
+
+
+def usage_series(session, sites, resolution='month', start='1900-01-01', end='9999-12-31'):
+    """
+    Usage, cars and gallons per car for one or many sites, resampled to a
+    week, month, quarter or year with the aggregation done in Postgres, so
+    multi-year series come back as one row per site and period.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f'resolution must be one of {RESOLUTIONS}, not {resolution!r}')
+    if isinstance(sites, str):
+        sites = [sites]
+
+    series = pd.read_sql(SERIES_QUERY, session.connection(),
+                         params={'resolution': resolution, 'sites': list(sites), 'start': start, 'end': end},
+                         parse_dates=['period'])
+
+    return series.astype(SERIES_DTYPES)
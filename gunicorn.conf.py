@@ -0,0 +1,48 @@
+"""
+Serving profile for the dashboard: `gunicorn app:server -c gunicorn.conf.py`.
+
+Threaded workers (gthread) suit this app: callbacks mostly wait on Postgres,
+so a few processes with several threads each serve many concurrent page
+loads without multiplying memory per process, and a slow export only ties
+up one thread. Each process holds its own connection pools (see
+common.heroku_psql.shared_engine): keep threads at or below the dashboard
+pool's pool_size + max_overflow (10), and workers * (10 + threads) under the
+Postgres plan's connection limit (10 dashboard connections plus one export
+connection per thread, see dashboard.exports.EXPORT_POOL_SIZE, per process).
+
+Every setting can be overridden from the environment, e.g. WEB_CONCURRENCY
+on Heroku.
+"""
+import os
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Heroku sets WEB_CONCURRENCY from the dyno's memory
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Worker heartbeat, not a request limit: Heroku's router gives every request 30 s
+# to send its first byte, which is why XLSX exports are capped in size (see
+# dashboard.exports.XLSX_EXPORT_MAX_ROWS) while CSV exports stream from the start
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+# Heroku's router keeps connections open, reuse them for asset and callback requests
+keepalive = 5
+
+# Recycle workers now and then so pandas/plotly heap growth doesn't accumulate
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+# Import the app in each worker, after the fork, so no engine or socket is shared
+preload_app = False
+
+accesslog = '-'
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's prometheus_client samples when metrics are multiprocess"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,74 @@
+-- Bring a database created by the original single-site app up to the
+-- multi-site schema in common/models.py.
+--
+--     heroku pg:psql --app autobell-beta < migrations/001_multi_site.sql
+--
+-- create_all only creates missing tables, it never alters existing ones, so the
+-- per-site keys every report and meter load upserts on (ON CONFLICT (site,
+-- date_added), ON CONFLICT (site, start_date)) have to be added here. Existing
+-- rows belong to the original site, autobell_25. Same-day reruns of the old
+-- load inserted a new report row each time; only the latest (highest id) of
+-- each (site, date_added) is kept.
+--
+-- Runs in one transaction and can be re-run. Afterwards create the new tables
+-- and fill the current_* rollups:
+--
+--     python -c "from common.heroku_psql import get_connector; from common.models import *; \
+--         from autobell_etl.etl.bulk_load import rebuild_current_reports; c = get_connector(external=True); \
+--         create_tables(c.engine); \
+--         rebuild_current_reports(c, AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)"
+
+BEGIN;
+
+-- Meter reads: keyed per site, NULL gal/car for periods without cars
+ALTER TABLE autobell_complete_data ADD COLUMN IF NOT EXISTS site VARCHAR NOT NULL DEFAULT 'autobell_25';
+ALTER TABLE autobell_complete_data ALTER COLUMN gallons_car DROP NOT NULL;
+ALTER TABLE autobell_complete_data DROP CONSTRAINT IF EXISTS autobell_complete_data_end_date_key;
+ALTER TABLE autobell_complete_data DROP CONSTRAINT IF EXISTS autobell_complete_data_site_end_date_key;
+ALTER TABLE autobell_complete_data DROP CONSTRAINT IF EXISTS autobell_complete_data_pkey;
+ALTER TABLE autobell_complete_data ADD CONSTRAINT autobell_complete_data_pkey PRIMARY KEY (site, start_date);
+ALTER TABLE autobell_complete_data ADD CONSTRAINT autobell_complete_data_site_end_date_key UNIQUE (site, end_date);
+
+-- Report history: one row per site and day
+ALTER TABLE pre_post_reports ADD COLUMN IF NOT EXISTS site VARCHAR NOT NULL DEFAULT 'autobell_25';
+DELETE FROM pre_post_reports a USING pre_post_reports b
+WHERE a.site = b.site AND a.date_added = b.date_added AND a.id < b.id;
+ALTER TABLE pre_post_reports DROP CONSTRAINT IF EXISTS pre_post_reports_site_date_added_key;
+ALTER TABLE pre_post_reports ADD CONSTRAINT pre_post_reports_site_date_added_key UNIQUE (site, date_added);
+
+ALTER TABLE payback_reports ADD COLUMN IF NOT EXISTS site VARCHAR NOT NULL DEFAULT 'autobell_25';
+DELETE FROM payback_reports a USING payback_reports b
+WHERE a.site = b.site AND a.date_added = b.date_added AND a.id < b.id;
+ALTER TABLE payback_reports DROP CONSTRAINT IF EXISTS payback_reports_site_date_added_key;
+ALTER TABLE payback_reports ADD CONSTRAINT payback_reports_site_date_added_key UNIQUE (site, date_added);
+-- NULL when the savings never pay the solution back
+ALTER TABLE payback_reports ALTER COLUMN breakeven_months DROP NOT NULL;
+
+ALTER TABLE cashflow_reports ADD COLUMN IF NOT EXISTS site VARCHAR NOT NULL DEFAULT 'autobell_25';
+DELETE FROM cashflow_reports a USING cashflow_reports b
+WHERE a.site = b.site AND a.date_added = b.date_added AND a.id < b.id;
+ALTER TABLE cashflow_reports DROP CONSTRAINT IF EXISTS cashflow_reports_site_date_added_key;
+ALTER TABLE cashflow_reports ADD CONSTRAINT cashflow_reports_site_date_added_key UNIQUE (site, date_added);
+
+-- Tables an earlier multi-site deploy may have created with fewer columns;
+-- skipped when create_all hasn't made them yet
+ALTER TABLE IF EXISTS current_payback_reports ALTER COLUMN breakeven_months DROP NOT NULL;
+
+ALTER TABLE IF EXISTS sites
+    ADD COLUMN IF NOT EXISTS reclaim_gal NUMERIC,
+    ADD COLUMN IF NOT EXISTS baseline_months INTEGER,
+    ADD COLUMN IF NOT EXISTS annual_water_cost NUMERIC,
+    ADD COLUMN IF NOT EXISTS solution_cost NUMERIC,
+    ADD COLUMN IF NOT EXISTS post_window INTEGER;
+
+-- State rows without the install date or the sums of squares are rebuilt by
+-- the next incremental run
+ALTER TABLE IF EXISTS etl_site_state
+    ADD COLUMN IF NOT EXISTS install_date DATE,
+    ADD COLUMN IF NOT EXISTS pre_cars_sq_sum NUMERIC,
+    ADD COLUMN IF NOT EXISTS pre_usage_sq_sum NUMERIC,
+    ADD COLUMN IF NOT EXISTS pre_gal_car_count INTEGER,
+    ADD COLUMN IF NOT EXISTS pre_gal_car_sum NUMERIC,
+    ADD COLUMN IF NOT EXISTS pre_gal_car_sq_sum NUMERIC;
+
+COMMIT;
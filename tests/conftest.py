@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.run import BenchmarkConnector, populate
+
+
+N_SITES = 2
+N_PERIODS = 20
+
+
+@pytest.fixture
+def connector(tmp_path):
+    """A SQLite database with N_SITES synthetic sites of N_PERIODS weekly meter reads and no reports"""
+    connector = BenchmarkConnector(f"sqlite:///{tmp_path / 'autobell.db'}")
+    populate(connector, N_SITES, N_PERIODS)
+    yield connector
+    connector.engine.dispose()
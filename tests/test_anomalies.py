@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from autobell_etl.etl.anomalies import detect
+from benchmarks import synthetic
+
+
+N_SITES = 3
+N_PERIODS = 104
+
+
+def _history():
+    history = synthetic.meter_reads(N_SITES, N_PERIODS)
+    history['start_date'] = pd.to_datetime(history.start_date)
+    return history
+
+
+def _period(history, site, period):
+    return history.index[history.site == synthetic.site_names(N_SITES)[site]][period]
+
+
+def test_clean_history_is_quiet():
+    assert detect(_history()).empty
+
+
+def test_flags_exactly_the_injected_faults():
+    history = _history()
+    leak, zero_cars, zero_usage = _period(history, 1, 80), _period(history, 0, 60), _period(history, 2, 90)
+
+    # Usage and gal/car up 80% on a normal car count
+    history.loc[leak, ['consumption_gal', 'gallons_car']] *= 1.8
+    # The car counter reads nothing while water is still used
+    history.loc[zero_cars, ['cars', 'gallons_car']] = [0.0, np.nan]
+    # The meter stalls while cars go through
+    history.loc[zero_usage, ['consumption_gal', 'gallons_car']] = 0.0
+
+    alerts = detect(history)
+
+    expected = history.loc[[zero_cars, leak, zero_usage], ['site', 'start_date']].assign(
+        kind=['counter_fault', 'leak', 'meter_regression'])
+    pd.testing.assert_frame_equal(alerts[['site', 'start_date', 'kind']], expected.reset_index(drop=True))
+    assert alerts.value.tolist()[1] == history.gallons_car[leak]
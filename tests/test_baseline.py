@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from autobell_etl.etl import baseline
+
+
+def test_unset_config_keeps_the_original_model():
+    config = baseline.site_config({'reclaim_gal': None, 'baseline_months': None})
+
+    assert config['reclaim_gal'] == 8800.00
+    assert config['baseline_months'] == 13
+    assert config['annual_water_cost'] == 31876.00
+    assert config['solution_cost'] == 5500.00
+
+
+def test_baseline_matches_the_original_formula():
+    pre_data = pd.DataFrame({'cars': [3000.0] * 13, 'consumption_gal': [120000.0] * 13, 'gallons_car': [40.0] * 13})
+    pre = baseline.baseline(baseline.pre_stats(pre_data), baseline.site_config(None))
+
+    assert pre['cars'] == 3000.0
+    assert pre['usage'] == pytest.approx((13 * 120000.0 - 8800.0) / 13)
+    assert pre['gal_car'] == pytest.approx(pre['usage'] / 3000.0)
+
+
+def test_no_pre_install_periods_has_no_baseline():
+    stats = baseline.empty_pre_stats()
+
+    assert baseline.baseline(stats, baseline.site_config(None)) is None
+
+
+def test_baseline_variance_matches_the_pre_period_rows():
+    pre_data = pd.DataFrame({'cars': [2900.0, 3100.0, 3000.0, 0.0],
+                             'consumption_gal': [118000.0, 125000.0, 121000.0, 400.0],
+                             'gallons_car': [40.69, 40.32, 40.33, float('nan')]})
+    # Folding the rows in one at a time gives the same statistics as all at once
+    stats = baseline.empty_pre_stats()
+    for i in range(len(pre_data)):
+        for key, value in baseline.pre_stats(pre_data.iloc[i:i + 1]).items():
+            stats[key] += value
+    pre = baseline.baseline(stats, baseline.site_config(None))
+
+    assert pre['cars_var'] == pytest.approx(pre_data.cars.var())
+    assert pre['usage_var'] == pytest.approx(pre_data.consumption_gal.var())
+    assert pre['gal_car_var'] == pytest.approx(pre_data.gallons_car.var())
@@ -0,0 +1,107 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+
+from autobell_etl.etl.autobell_etl import AutobellETL
+from autobell_etl.etl.bulk_load import bulk_load_reports, current_table
+from benchmarks import synthetic
+from common.heroku_psql import normalize_uri
+from common.models import DEFAULT_SITE, AutobellCashFlowItem, AutobellPaybackItem, AutobellPrePostItem
+
+
+REPORT_ITEMS = (AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)
+MIGRATION = Path(__file__).resolve().parent.parent / 'migrations' / '001_multi_site.sql'
+
+
+def _load(connector, bundles):
+    bulk_load_reports(connector, bundles, *REPORT_ITEMS).raise_for_errors()
+
+
+def _earlier(bundle, days):
+    """The same reports, dated `days` earlier"""
+    return dict(bundle, **{key: dict(bundle[key], date_added=bundle[key]['date_added'] - timedelta(days=days))
+                           for key in ('pre_post', 'payback', 'cashflow')})
+
+
+def test_reloading_a_bundle_keeps_one_row_per_day(connector):
+    site = synthetic.site_names(1)[0]
+    bundle = AutobellETL(connector, *REPORT_ITEMS, site=site).build_reports()
+
+    _load(connector, [bundle])
+    _load(connector, [bundle])
+
+    with connector.Session as session:
+        for item in REPORT_ITEMS:
+            table = item.__table__
+            assert session.execute(select(func.count()).select_from(table).where(table.c.site == site)).scalar() == 1
+            assert session.execute(select(func.count()).select_from(current_table(item))).scalar() == 1
+
+
+def test_current_reports_keep_the_newest_day(connector):
+    site = synthetic.site_names(1)[0]
+    bundle = AutobellETL(connector, *REPORT_ITEMS, site=site).build_reports()
+    older = _earlier(bundle, 1)
+    older['pre_post']['post_cars'] += 100
+
+    _load(connector, [bundle])
+    # A backfill of an earlier day lands in the history but not in the rollup
+    _load(connector, [older])
+
+    with connector.Session as session:
+        table = AutobellPrePostItem.__table__
+        assert session.execute(select(func.count()).select_from(table).where(table.c.site == site)).scalar() == 2
+        for item in REPORT_ITEMS:
+            current = session.execute(select(current_table(item)).where(current_table(item).c.site == site)).one()
+            assert current.date_added == bundle['pre_post']['date_added']
+        current = session.execute(select(current_table(AutobellPrePostItem))).one()
+        assert float(current.post_cars) == pytest.approx(bundle['pre_post']['post_cars'])
+
+
+@pytest.mark.skipif('TEST_DATABASE_URL' not in os.environ,
+                    reason='needs a scratch Postgres database in TEST_DATABASE_URL')
+def test_migration_dedupes_and_adds_the_site_keys():
+    engine = create_engine(normalize_uri(os.environ['TEST_DATABASE_URL']))
+    tables = ['autobell_complete_data', 'pre_post_reports', 'payback_reports', 'cashflow_reports']
+    years = ', '.join(f'year_{n} NUMERIC NOT NULL' for n in range(1, 11))
+    with engine.begin() as connection:
+        for table in tables + ['current_payback_reports', 'sites', 'etl_site_state']:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table};"))
+        # The original single-site schema, with a same-day rerun in every report table
+        connection.execute(text("""
+            CREATE TABLE autobell_complete_data (start_date DATE PRIMARY KEY, end_date DATE UNIQUE NOT NULL,
+                start_meter_cubic NUMERIC NOT NULL, end_meter_cubic NUMERIC NOT NULL, cars NUMERIC NOT NULL,
+                days INTEGER NOT NULL, consumption_cubic NUMERIC NOT NULL, start_meter_gal NUMERIC NOT NULL,
+                end_meter_gal NUMERIC NOT NULL, consumption_gal NUMERIC NOT NULL, gallons_car NUMERIC NOT NULL);
+            CREATE TABLE pre_post_reports (id SERIAL PRIMARY KEY, date_added DATE NOT NULL, pre_cars NUMERIC NOT NULL);
+            CREATE TABLE payback_reports (id SERIAL PRIMARY KEY, date_added DATE NOT NULL,
+                breakeven_months NUMERIC NOT NULL);"""))
+        connection.execute(text(f"CREATE TABLE cashflow_reports (id SERIAL PRIMARY KEY, date_added DATE NOT NULL, "
+                                f"project_install NUMERIC NOT NULL, {years});"))
+        connection.execute(text("""
+            INSERT INTO pre_post_reports (date_added, pre_cars) VALUES ('2022-05-01', 1), ('2022-05-01', 2), ('2022-05-02', 3);
+            INSERT INTO payback_reports (date_added, breakeven_months) VALUES ('2022-05-01', 1), ('2022-05-01', 2);"""))
+        connection.execute(text(f"INSERT INTO cashflow_reports (date_added, project_install, "
+                                f"{', '.join(f'year_{n}' for n in range(1, 11))}) "
+                                f"VALUES ('2022-05-01', {', '.join(['0'] * 11)}), ('2022-05-01', {', '.join(['1'] * 11)});"))
+
+    # Twice, it is safe to re-run
+    for _ in range(2):
+        raw = engine.raw_connection()
+        try:
+            raw.autocommit = True
+            raw.cursor().execute(MIGRATION.read_text())
+        finally:
+            raw.close()
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT site, pre_cars FROM pre_post_reports ORDER BY date_added;")).all() == \
+            [(DEFAULT_SITE, 2), (DEFAULT_SITE, 3)]
+        assert connection.execute(text("SELECT count(*) FROM payback_reports;")).scalar() == 1
+        assert connection.execute(text("SELECT year_1 FROM cashflow_reports;")).scalar() == 1
+        keys = connection.execute(text("""
+            SELECT conname FROM pg_constraint WHERE conrelid = 'autobell_complete_data'::regclass;""")).scalars().all()
+        assert sorted(keys) == ['autobell_complete_data_pkey', 'autobell_complete_data_site_end_date_key']
+    engine.dispose()
@@ -0,0 +1,23 @@
+from datetime import date
+
+from dashboard.data import _parse_filter
+
+
+def test_typed_filter_values():
+    conditions, params = _parse_filter('{cars} > 100 && {start_date} ge 2022-04-07')
+
+    assert conditions == ['cars > :filter_0', 'start_date >= :filter_1']
+    assert params == {'filter_0': 100.0, 'filter_1': date(2022, 4, 7)}
+
+
+def test_values_of_the_wrong_type_are_dropped():
+    conditions, params = _parse_filter('{cars} > lots && {end_date} < yesterday && {gallons_car} = nan && {cars} < 5')
+
+    assert conditions == ['cars < :filter_3']
+    assert params == {'filter_3': 5.0}
+
+
+def test_pattern_filters_stay_text():
+    conditions, params = _parse_filter('{start_date} datestartswith 2022')
+
+    assert params == {'filter_0': '2022%'}
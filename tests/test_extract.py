@@ -0,0 +1,71 @@
+import asyncio
+import os
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from autobell_etl.etl.autobell_etl import AutobellETL
+from benchmarks import synthetic
+from benchmarks.run import BenchmarkConnector, populate
+from common.models import AutobellCashFlowItem, AutobellPaybackItem, AutobellPrePostItem
+from tests.conftest import N_PERIODS, N_SITES
+
+
+REPORT_ITEMS = (AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)
+
+
+def test_install_date_is_a_date(connector):
+    site = synthetic.site_names(1)[0]
+    etl = AutobellETL(connector, *REPORT_ITEMS, site=site)
+
+    with connector.Session as session:
+        assert etl.install_date(session) == synthetic.install_date(N_PERIODS)
+        assert type(etl.install_date(session)) is date
+
+
+def test_extract_binds_install_date_as_date(connector):
+    bound = []
+
+    @event.listens_for(connector.engine, 'before_cursor_execute')
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'start_date <' in statement or 'start_date >=' in statement:
+            bound.extend(parameters)
+
+    site = synthetic.site_names(1)[0]
+    pre_data, post_data = AutobellETL(connector, *REPORT_ITEMS, site=site).extract()
+
+    assert len(pre_data) == N_PERIODS // 2
+    assert len(post_data) == N_PERIODS - N_PERIODS // 2
+    assert synthetic.install_date(N_PERIODS) in bound
+    assert not any(isinstance(value, str) and value[:4].isdigit() for value in bound)
+
+
+@pytest.mark.skipif('TEST_DATABASE_URL' not in os.environ,
+                    reason='needs a scratch Postgres database in TEST_DATABASE_URL')
+def test_async_extract_with_run_sync(monkeypatch):
+    pytest.importorskip('asyncpg')
+    from common.heroku_psql import AsyncHerokuDBConnector, normalize_uri
+
+    url = normalize_uri(os.environ['TEST_DATABASE_URL'])
+    sync_connector = BenchmarkConnector(url)
+    populate(sync_connector, N_SITES, N_PERIODS)
+    sync_connector.engine.dispose()
+    monkeypatch.setenv('DATABASE_URL', url)
+
+    site = synthetic.site_names(1)[0]
+    etl = AutobellETL(None, *REPORT_ITEMS, site=site)
+
+    async def extract():
+        connector = AsyncHerokuDBConnector(pool_size=1, max_overflow=0)
+        try:
+            async with connector.Session as session:
+                return await session.run_sync(etl.extract_with)
+        finally:
+            await connector.engine.dispose()
+
+    pre_data, post_data = asyncio.run(extract())
+
+    assert type(etl._install_date) is date
+    assert len(pre_data) == N_PERIODS // 2
+    assert len(post_data) == N_PERIODS - N_PERIODS // 2
@@ -0,0 +1,76 @@
+import logging
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from autobell_etl.etl.autobell_etl import AutobellETL
+from autobell_etl.etl.incremental_etl import IncrementalAutobellETL
+from benchmarks import synthetic
+from common.models import AutobellCashFlowItem, AutobellPaybackItem, AutobellPrePostItem, AutobellSiteStateItem
+from tests.conftest import N_PERIODS
+
+
+REPORT_ITEMS = (AutobellPrePostItem, AutobellPaybackItem, AutobellCashFlowItem)
+
+
+def _set_install_date(connector, site, install_date):
+    with connector.engine.begin() as connection:
+        connection.execute(text("UPDATE sites SET install_date = :install_date WHERE site = :site;"),
+                           {'site': site, 'install_date': install_date})
+
+
+def _install_before_first_period(connector, site):
+    _set_install_date(connector, site, synthetic.FIRST_PERIOD - timedelta(days=7))
+
+
+def test_incremental_reports_a_site(connector):
+    site = synthetic.site_names(1)[0]
+
+    assert IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site).etl_reports() is True
+
+    with connector.Session as session:
+        state = session.get(AutobellSiteStateItem, site)
+        assert state.pre_count == N_PERIODS // 2
+
+
+def test_site_without_pre_install_periods_is_skipped(connector, caplog):
+    site, other = synthetic.site_names(2)
+    _install_before_first_period(connector, site)
+    etl = IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site)
+
+    with caplog.at_level(logging.WARNING):
+        bundle = etl.build_reports()
+
+    assert 'pre_post' not in bundle
+    assert bundle['state']['pre_count'] == 0
+    assert bundle['state']['high_water_mark'] is not None
+    assert f'{site}: no reports' in caplog.text
+
+    # Loading the state-only bundle works, and other sites still report
+    etl.load_reports([bundle]).raise_for_errors()
+    assert IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=other).etl_reports() is True
+
+
+def test_full_etl_skips_a_site_without_pre_install_periods(connector):
+    site = synthetic.site_names(1)[0]
+    _install_before_first_period(connector, site)
+
+    assert AutobellETL(connector, *REPORT_ITEMS, site=site).etl_reports() is False
+
+
+def test_install_date_change_rebuilds_the_state(connector):
+    site = synthetic.site_names(1)[0]
+    assert IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site).etl_reports() is True
+
+    install_date = synthetic.install_date(N_PERIODS) - timedelta(weeks=4)
+    _set_install_date(connector, site, install_date)
+    bundle = IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site).build_reports()
+    full = AutobellETL(connector, *REPORT_ITEMS, site=site).build_reports()
+
+    assert bundle['state']['pre_count'] == N_PERIODS // 2 - 4
+    assert bundle['state']['install_date'] == install_date
+    assert bundle['pre_post'] == full['pre_post']
+
+    # The rebuilt state is kept, so the next run has nothing new to read
+    IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site).load_reports([bundle]).raise_for_errors()
+    assert IncrementalAutobellETL(connector, *REPORT_ITEMS, AutobellSiteStateItem, site=site).etl_reports() is False
@@ -0,0 +1,67 @@
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from autobell_etl.etl.ingest import derive_columns, ingest, validate
+from benchmarks import synthetic
+from benchmarks.run import BenchmarkConnector, populate
+from common.heroku_psql import normalize_uri
+from tests.conftest import N_PERIODS, N_SITES
+
+
+def _raw(cars):
+    return pd.DataFrame({'start_date': ['2022-01-03', '2022-01-10', '2022-01-17'],
+                         'end_date': ['2022-01-10', '2022-01-17', '2022-01-24'],
+                         'start_meter_cubic': [100.0, 110.0, 111.0],
+                         'end_meter_cubic': [110.0, 111.0, 120.0],
+                         'cars': cars})
+
+
+def test_zero_car_period_is_kept_with_null_gallons_car():
+    chunk = derive_columns(_raw([300, 0, 250]), site='test_site')
+
+    assert validate(chunk, {}).all()
+    assert np.isnan(chunk.gallons_car[1])
+    assert chunk.gallons_car[[0, 2]].notna().all()
+
+
+def test_negative_cars_and_backwards_meter_are_rejected():
+    raw = _raw([300, -5, 250])
+    raw.loc[2, 'end_meter_cubic'] = 105.0
+
+    assert validate(derive_columns(raw, site='test_site'), {}).tolist() == [True, False, False]
+
+
+def test_first_read_is_checked_against_the_carried_read():
+    last_reads = {'test_site': (pd.Timestamp('2022-01-03'), 105.0)}
+
+    assert validate(derive_columns(_raw([300, 0, 250]), site='test_site'), last_reads).tolist() == [False, True, True]
+
+
+@pytest.mark.skipif('TEST_DATABASE_URL' not in os.environ,
+                    reason='needs a scratch Postgres database in TEST_DATABASE_URL')
+def test_appended_file_is_checked_against_the_stored_reads(tmp_path):
+    connector = BenchmarkConnector(normalize_uri(os.environ['TEST_DATABASE_URL']))
+    populate(connector, N_SITES, N_PERIODS)
+    site = synthetic.site_names(1)[0]
+    with connector.engine.connect() as connection:
+        end_date, end_meter = connection.execute(text("""
+            SELECT end_date, end_meter_cubic FROM autobell_complete_data
+            WHERE site = :site ORDER BY start_date DESC LIMIT 1;"""), {'site': site}).one()
+
+    # Next month's export for the site, whose meter ran backwards since the last stored read
+    starts = [end_date + timedelta(weeks=week) for week in range(2)]
+    path = tmp_path / 'next_month.csv'
+    pd.DataFrame({'site': site, 'start_date': starts, 'end_date': [start + timedelta(weeks=1) for start in starts],
+                  'start_meter_cubic': [float(end_meter) - 50, float(end_meter) + 500],
+                  'end_meter_cubic': [float(end_meter) + 500, float(end_meter) + 1000],
+                  'cars': 3000}).to_csv(path, index=False)
+
+    result = ingest([path], connector=connector)
+
+    assert (result.loaded, result.rejected) == (1, 1)
+    connector.engine.dispose()
@@ -0,0 +1,11 @@
+import numpy as np
+
+from autobell_etl.etl.projections import payback_projection
+
+
+def test_breakeven():
+    projection = payback_projection(31876.00, [15.0, 0.0, -5.0], 5500.00)
+
+    assert projection['breakeven_months'][0] == round(5500.00 / round(31876.00 * 0.15 / 12, 2), 2)
+    # Never breaks even: NaN, loaded as NULL
+    assert np.isnan(projection['breakeven_months'][1:]).all()
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+
+from autobell_etl.etl.anomalies import detect_alerts
+from benchmarks import synthetic
+from common.models import AutobellAlertItem, AutobellItem
+from common.typed_read import ColumnarCache, read_meter_history
+from tests.conftest import N_PERIODS
+
+
+pytest.importorskip('pyarrow')
+
+
+def _append_period(connector, site):
+    table = AutobellItem.__table__
+    with connector.engine.begin() as connection:
+        last = connection.execute(select(table).where(table.c.site == site)
+                                  .order_by(table.c.start_date.desc()).limit(1)).mappings().one()
+        connection.execute(table.insert(), dict(last, start_date=last['end_date'],
+                                                end_date=last['end_date'] + timedelta(weeks=1)))
+
+
+def test_cached_history_only_reads_new_periods(connector, tmp_path):
+    cache = ColumnarCache(tmp_path / 'history')
+    site = synthetic.site_names(1)[0]
+
+    with connector.Session as session:
+        assert len(read_meter_history(session, site, cache)) == N_PERIODS
+    assert len(cache.load(site)) == N_PERIODS
+
+    _append_period(connector, site)
+    with connector.Session as session:
+        history = read_meter_history(session, site, cache)
+
+    assert len(history) == N_PERIODS + 1
+    assert history.start_date.is_monotonic_increasing
+    assert len(cache.load(site)) == N_PERIODS + 1
+
+
+def test_invalidate_from_only_drops_backfilled_sites(connector, tmp_path):
+    cache = ColumnarCache(tmp_path / 'history')
+    site, other = synthetic.site_names(2)
+    with connector.Session as session:
+        for name in (site, other):
+            read_meter_history(session, name, cache)
+    last = cache.load(site).start_date.max()
+
+    cache.invalidate_from(site, last)
+    cache.invalidate_from(other, last + timedelta(weeks=1))
+
+    assert cache.load(site) is None
+    assert len(cache.load(other)) == N_PERIODS
+
+
+def test_alerts_read_through_the_cache_match(connector, tmp_path):
+    cache = ColumnarCache(tmp_path / 'history')
+
+    flagged = detect_alerts(connector, AutobellAlertItem)
+    assert detect_alerts(connector, AutobellAlertItem, cache=cache) == flagged
+    # The second run reads every site's history from the cache
+    assert detect_alerts(connector, AutobellAlertItem, cache=cache) == flagged
+    assert sorted(path.stem for path in (tmp_path / 'history').iterdir()) == synthetic.site_names(2)